@@ -0,0 +1,301 @@
+# benchmark.py
+
+"""
+Benchmarks reprodutíveis do grafo, do routing e do MOEA/D.
+
+Usa os feeds STCP/Metro do projeto e conjuntos de pedidos origem-destino
+sintéticos (gerados com semente fixa à volta das paragens). Mede:
+    build.*      compilação a frio do grafo (tempo e pico de memória)
+    snapshot.*   arranque a partir do snapshot (tempo e pico de memória)
+    query.*      pedido completo (paragens próximas + grafo do pedido + dijkstra)
+    dijkstra.*   só o dijkstra (p50/p95/p99, ms)
+    moead.*      gerações por segundo
+    batch.*      casos por segundo do run_tests com N processos
+
+A compilação e o arranque correm em processos novos, com uma pasta de
+snapshots temporária (CIN_CACHE_DIR), para não depender nem mexer na cache
+do projeto.
+
+    python3 benchmark.py --save baseline.json
+    python3 benchmark.py --compare baseline.json [--tolerance 0.15]
+
+No modo de comparação o programa termina com código 1 se alguma métrica
+piorar mais do que a tolerância, e recusa comparar (código 2) se o baseline
+foi medido com outros parâmetros (dia, pedidos, casos, processos, semente).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Sentido de cada métrica: True se valores maiores são melhores
+HIGHER_IS_BETTER = ('_per_s',)
+
+
+# ---------------------------
+# Utilitários
+# ---------------------------
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def percentiles_ms(samples, prefix):
+    ms = np.asarray(samples) * 1000
+    return {
+        f"{prefix}.p50_ms": float(np.percentile(ms, 50)),
+        f"{prefix}.p95_ms": float(np.percentile(ms, 95)),
+        f"{prefix}.p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def synthetic_od_pairs(n, seed=0, jitter_km=0.3, min_km=1.0):
+    """
+    Pares (origem, destino) em (lat, lon) perto de paragens escolhidas ao
+    acaso (semente fixa), com pelo menos min_km entre origem e destino.
+    """
+    from graph_builder import graph_arrays
+    from geometry import haversine_distance
+
+    rng = np.random.default_rng(seed)
+    lat, lon = graph_arrays['node_lat'], graph_arrays['node_lon']
+    deg = jitter_km / 111.0
+    pairs = []
+    while len(pairs) < n:
+        i, j = rng.integers(len(lat), size=2)
+        a = (float(lat[i] + rng.uniform(-deg, deg)), float(lon[i] + rng.uniform(-deg, deg)))
+        b = (float(lat[j] + rng.uniform(-deg, deg)), float(lon[j] + rng.uniform(-deg, deg)))
+        if haversine_distance(a[0], a[1], b[0], b[1]) >= min_km:
+            pairs.append((a, b))
+    return pairs
+
+
+def benchmark_date():
+    """Hoje, se houver serviços; senão o dia do feed com mais serviços ativos"""
+    from graph_builder import service_calendar
+    from datetime import timedelta
+
+    today = datetime.today().date()
+    if service_calendar.service_mask(today).any() or service_calendar.first_date is None:
+        return today
+    busiest = int(service_calendar.active.sum(axis=1).argmax())
+    return service_calendar.first_date + timedelta(days=busiest)
+
+
+# ---------------------------
+# Etapas em processos novos
+# ---------------------------
+def _stage_import():
+    """Executado no subprocesso: importa o graph_builder e mede tempo e memória"""
+    t0 = time.perf_counter()
+    import graph_builder  # noqa: F401 (carrega ou compila o grafo)
+    seconds = time.perf_counter() - t0
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def _run_stage(cache_dir):
+    env = dict(os.environ, CIN_CACHE_DIR=cache_dir)
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--stage', 'import'],
+        cwd=HERE, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def bench_build(results):
+    """Compilação a frio (cache vazia) e arranque a partir do snapshot acabado de criar"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = _run_stage(cache_dir)
+        warm = [_run_stage(cache_dir) for _ in range(3)]
+    results['build.cold_s'] = cold['seconds']
+    results['build.peak_rss_mb'] = cold['peak_rss_mb']
+    results['snapshot.load_s'] = min(w['seconds'] for w in warm)
+    results['snapshot.peak_rss_mb'] = max(w['peak_rss_mb'] or 0 for w in warm) or None
+
+
+# ---------------------------
+# Etapas no próprio processo
+# ---------------------------
+def bench_queries(results, date, n_queries, seed):
+    import init_population
+    import routing
+
+    init_population.day_graph(date)  # grafo do dia fora da medição
+    pairs = synthetic_od_pairs(n_queries, seed)
+
+    query_times, dijkstra_times = [], []
+    found = 0
+    for start, end in pairs:
+        t0 = time.perf_counter()
+        path, graph = init_population.initialize_population(start, end, date=date)
+        query_times.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        routing.dijkstra(graph, graph.start, graph.end)
+        dijkstra_times.append(time.perf_counter() - t0)
+        found += bool(path)
+
+    results.update(percentiles_ms(query_times, 'query'))
+    results.update(percentiles_ms(dijkstra_times, 'dijkstra'))
+    results['query.found_ratio'] = found / len(pairs)
+
+
+def bench_moead(results, date, seed, num_gens=10, pop_size=20, n_pairs=3):
+    from moead import moead
+    from path_evaluation import objective_cache
+
+    gens_per_s = []
+    for k, (start, end) in enumerate(synthetic_od_pairs(n_pairs, seed + 1)):
+        objective_cache.clear()
+        random.seed(seed + k)
+        np.random.seed(seed + k)
+        elapsed = []
+        moead(num_gens=num_gens, pop_size=pop_size, T=5, start_coords=start, end_coords=end, date=date,
+              callback=lambda stats: elapsed.append(stats['elapsed']))
+        # Só as gerações (sem a população inicial)
+        gens_per_s.append((num_gens - 1) / (elapsed[-1] - elapsed[0]))
+    results['moead.gens_per_s'] = float(np.median(gens_per_s))
+
+
+def bench_batch(results, date, seed, n_cases, worker_counts):
+    from path_evaluation import objective_cache
+    from run_tests import run_all_tests
+
+    pairs = synthetic_od_pairs(n_cases, seed + 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        test_file = os.path.join(tmp, 'cases.txt')
+        with open(test_file, 'w') as f:
+            for (a, b) in pairs:
+                f.write(f"{a[0]},{a[1]},{b[0]},{b[1]},3,3,10\n")
+        for workers in worker_counts:
+            # Os mesmos casos e sementes em cada etapa: com a cache de objetivos
+            # do processo (herdada pelos workers) mediríamos acertos, não trabalho
+            objective_cache.clear()
+            t0 = time.perf_counter()
+            run_all_tests(test_file, os.path.join(tmp, f'out_{workers}.txt'), workers=workers, seed=seed, date=date)
+            results[f'batch.w{workers}.cases_per_s'] = n_cases / (time.perf_counter() - t0)
+
+
+# ---------------------------
+# Baseline e comparação
+# ---------------------------
+def param_mismatches(params, baseline):
+    """Lista de (parâmetro, baseline, atual) dos parâmetros que diferem do baseline"""
+    base = baseline.get('params', {})
+    return [(key, base.get(key), value) for key, value in params.items() if base.get(key) != value]
+
+
+def compare(current, baseline, tolerance):
+    """Lista de (métrica, baseline, atual, variação) das métricas que pioraram"""
+    regressions = []
+    for key, base in baseline['results'].items():
+        cur = current['results'].get(key)
+        if not isinstance(base, (int, float)) or not isinstance(cur, (int, float)) or base == 0:
+            continue
+        if key.endswith('found_ratio'):
+            continue
+        change = (cur - base) / abs(base)
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        if worse > tolerance:
+            regressions.append((key, base, cur, change))
+    return regressions
+
+
+def run(args, baseline=None):
+    date = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else benchmark_date()
+    params = {'date': str(date), 'seed': args.seed, 'queries': args.queries,
+              'cases': args.cases, 'workers': args.workers}
+
+    # Resultados com outros parâmetros não são comparáveis: recusar antes de medir
+    if baseline is not None:
+        mismatches = param_mismatches(params, baseline)
+        if mismatches:
+            print("O baseline foi medido com outros parâmetros:")
+            for key, base, cur in mismatches:
+                print(f"  {key}: {base} (baseline) != {cur}")
+            sys.exit(2)
+
+    results = {}
+    if not args.skip_build:
+        print("Compilação a frio e arranque do snapshot ...")
+        bench_build(results)
+
+    # O resto usa o grafo da cache do projeto
+    print(f"Dia de serviço: {date}")
+    print(f"Pedidos ({args.queries}) ...")
+    bench_queries(results, date, args.queries, args.seed)
+    print("MOEA/D ...")
+    bench_moead(results, date, args.seed)
+    print("Lote de casos ...")
+    bench_batch(results, date, args.seed, args.cases, args.workers)
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do grafo, routing e MOEA/D")
+    parser.add_argument("--save", help="grava os resultados (JSON) neste ficheiro")
+    parser.add_argument("--compare", help="compara com um baseline gravado com --save")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="piora relativa admitida (0.15 = 15%%)")
+    parser.add_argument("--date", help="dia de serviço (AAAA-MM-DD)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--cases", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4], help="processos do lote (0 = nº de CPUs)")
+    parser.add_argument("--skip-build", action='store_true', help="não mede a compilação a frio")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if any(w < 0 for w in args.workers):
+        parser.error("--workers: o nº de processos não pode ser negativo")
+    args.workers = [w or os.cpu_count() or 1 for w in args.workers]
+
+    if args.stage == 'import':
+        _stage_import()
+        sys.exit(0)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = run(args, baseline)
+    for key, value in sorted(report['results'].items()):
+        print(f"{key:32s} {value:.4f}" if isinstance(value, float) else f"{key:32s} {value}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressões (> {args.tolerance:.0%}):")
+            for key, base, cur, change in regressions:
+                print(f"  {key}: {base:.4f} -> {cur:.4f} ({change:+.1%})")
+            sys.exit(1)
+        print("\nSem regressões.")
@@ -0,0 +1,86 @@
+# geometry.py
+
+"""
+Distâncias, tempos de viagem e emissões de CO2.
+
+Versão escalar (haversine_distance) para pontos isolados e versões
+vetorizadas em NumPy para arrays inteiros de arestas.
+"""
+
+import math
+import numpy as np
+from Constants import (
+    WALK_SPEED_KMH,
+    BUS_SPEED_KMH,
+    METRO_SPEED_KMH,
+    BUS_EMISSION_GCO2_PER_KM,
+    METRO_EMISSION_GCO2_PER_KM,
+    WALK_EMISSION_GCO2_PER_KM,
+)
+
+EARTH_RADIUS_KM = 6371.0
+
+# Velocidade (km/h) e emissões (g/km/pessoa) por operador (nome em maiúsculas)
+OPERATOR_SPEED_KMH = {
+    'WALK': WALK_SPEED_KMH,
+    'LINK': WALK_SPEED_KMH,
+    'STCP': BUS_SPEED_KMH,
+    'METRO': METRO_SPEED_KMH,
+}
+OPERATOR_CO2_G_PER_KM = {
+    'WALK': WALK_EMISSION_GCO2_PER_KM,
+    'LINK': WALK_EMISSION_GCO2_PER_KM,
+    'STCP': BUS_EMISSION_GCO2_PER_KM,
+    'METRO': METRO_EMISSION_GCO2_PER_KM,
+}
+
+# Velocidade máxima entre todos os modos (limite inferior do tempo de viagem)
+MAX_SPEED_KMH = max(OPERATOR_SPEED_KMH.values())
+
+
+# ---------------------------
+# Distância Haversine
+# ---------------------------
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Distância entre duas coordenadas GPS em km"""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
+    return 2 * EARTH_RADIUS_KM * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância Haversine (km) vetorizada; aceita escalares ou arrays (broadcast)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# ---------------------------
+# Tempos e emissões por operador
+# ---------------------------
+def per_operator(table, operators, default=np.nan):
+    """Valor da tabela para cada operador do array (sem distinguir maiúsculas)"""
+    operators = np.asarray(operators, dtype=str)
+    if operators.size == 0:
+        return np.empty(0)
+    names, inverse = np.unique(operators, return_inverse=True)
+    values = np.array([table.get(op.upper(), default) for op in names], dtype=float)
+    return values[inverse.reshape(-1)]
+
+
+def travel_times(dist_km, operators):
+    """Tempo de viagem (minutos); NaN para operadores desconhecidos"""
+    return np.asarray(dist_km, dtype=float) / per_operator(OPERATOR_SPEED_KMH, operators) * 60
+
+
+def co2_emissions(dist_km, operators):
+    """Emissões (g CO2) de cada aresta; 0 para operadores desconhecidos"""
+    return np.asarray(dist_km, dtype=float) * per_operator(OPERATOR_CO2_G_PER_KM, operators, default=0.0)
+
+
+def edge_metrics(lat1, lon1, lat2, lon2, operators):
+    """(distância_km, tempo_min, co2_g) para arrays de arestas"""
+    dist = haversine_km(lat1, lon1, lat2, lon2)
+    return dist, travel_times(dist, operators), co2_emissions(dist, operators)
@@ -1,250 +1,573 @@
-import pandas as pd
-import math
-import matplotlib.pyplot as plt
+# graph_builder.py
+
+import logging
+import os
+import numpy as np
 from datetime import datetime
+import graph_snapshot
+import metrics
+from spatial_index import SpatialIndex
+from service_calendar import ServiceCalendar
+from link_table import LinkTable, compile_links, OPERATORS, OP_STCP, OP_METRO, OP_MULTIMODAL
 
 # -----------------------------
 # --- Configurações
 # -----------------------------
-STCP_PATH = "dataset/stcp"
-METRO_PATH = "dataset/metro_porto"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STCP_PATH = os.path.join(BASE_DIR, "Dataset", "stcp")
+METRO_PATH = os.path.join(BASE_DIR, "Dataset", "metro_porto")
 MAX_DISTANCE_KM = 0.05  # 50 metros
 
+# Diagnósticos da compilação (silenciosos, a não ser que o logging seja configurado)
+log = logging.getLogger(__name__)
+
 # -----------------------------
-# --- Função Haversine
+# --- Ficheiros do feed
 # -----------------------------
-def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
+def feed_files(stcp_path=STCP_PATH, metro_path=METRO_PATH):
+    """Ficheiros GTFS lidos na compilação (o snapshot é identificado pelo seu hash)"""
+    common = ["stops.txt", "trips.txt", "stop_times.txt", "calendar.txt", "calendar_dates.txt"]
+    return (
+        [os.path.join(stcp_path, f) for f in common + ["transfers.txt"]]
+        + [os.path.join(metro_path, f) for f in common + ["fare_rules.txt"]]
+    )
 
 # -----------------------------
-# --- Carregar stops
+# --- Criar arestas originais
 # -----------------------------
-stcp_stops = pd.read_csv(f"{STCP_PATH}/stops.txt")
-metro_stops = pd.read_csv(f"{METRO_PATH}/stops.txt")
-stcp_stops['operator'] = 'STCP'
-metro_stops['operator'] = 'Metro'
+def gtfs_time_to_seconds(times):
+    """Horas GTFS 'H:MM:SS' (podem passar das 24h) → segundos; -1 se em falta"""
+    import pandas as pd
 
-print("Número de paragens STCP:", len(stcp_stops))
-print("Número de paragens Metro:", len(metro_stops))
-print("Total de paragens:", len(stcp_stops) + len(metro_stops))
+    parts = times.str.split(':', expand=True).apply(pd.to_numeric, errors='coerce')
+    seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return seconds.fillna(-1).astype(np.int32)
 
-# -----------------------------
-# --- Carregar trips (route_id e service_id)
-# -----------------------------
-stcp_trips = pd.read_csv(f"{STCP_PATH}/trips.txt")
-metro_trips = pd.read_csv(f"{METRO_PATH}/trips.txt")
+# Linhas do stop_times.txt lidas de cada vez (limita a memória com feeds grandes)
+STOP_TIMES_CHUNK_ROWS = 1_000_000
 
-stcp_trip_to_route = dict(zip(stcp_trips['trip_id'], stcp_trips['route_id']))
-stcp_trip_to_service = dict(zip(stcp_trips['trip_id'], stcp_trips['service_id']))
+_STOP_TIME_FIELDS = ('trip', 'stop', 'seq', 'arr', 'dep')
 
-metro_trip_to_route = dict(zip(metro_trips['trip_id'], metro_trips['route_id']))
-metro_trip_to_service = dict(zip(metro_trips['trip_id'], metro_trips['service_id']))
+def _category_codes(column, lookup_fn):
+    """
+    Coluna categórica → array int32, calculando lookup_fn só uma vez por
+    valor distinto (as categorias); valores em falta → -1.
+    """
+    lookup = np.append(np.asarray(lookup_fn(column.cat.categories), dtype=np.int32), -1)
+    return lookup[column.cat.codes.to_numpy()]
 
-# -----------------------------
-# --- Criar arestas originais
-# -----------------------------
-def create_edges(stop_times_file, operator, trip_to_route, trip_to_service):
-    stop_times = pd.read_csv(stop_times_file)
-    edges = []
-
-    for trip_id, group in stop_times.groupby("trip_id"):
-        group = group.sort_values("stop_sequence")
-        stops = group["stop_id"].tolist()
-        route_id = trip_to_route.get(trip_id)
-        service_id = trip_to_service.get(trip_id)
-
-        for i in range(len(stops) - 1):
-            edges.append({
-                'from': stops[i],
-                'to': stops[i+1],
-                'trip_id': trip_id,
-                'route_id': route_id,
-                'service_id': service_id,
-                'operator': operator
+def _stop_time_blocks(stop_times_file, node_index, trip_index, chunk_rows):
+    """
+    Blocos do stop_times.txt como arrays int32 {'trip', 'stop', 'seq', 'arr', 'dep'}.
+    Lê só as colunas necessárias, como categorias: os ids e as horas são
+    convertidos uma vez por valor distinto (paragem → índice do nó, -1 se
+    desconhecida; trip → código em trip_index; hora → segundos). As linhas
+    sem trip_id ficam de fora.
+    """
+    import pandas as pd
+
+    columns = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']
+    dtypes = {'trip_id': 'category', 'arrival_time': 'category', 'departure_time': 'category',
+              'stop_id': 'category', 'stop_sequence': np.int32}
+    times = lambda values: gtfs_time_to_seconds(pd.Series(values, dtype=str))
+    stops = lambda values: [node_index.get(v, -1) for v in values]
+    trips = lambda values: [trip_index.setdefault(v, len(trip_index)) for v in values]
+
+    for chunk in pd.read_csv(stop_times_file, usecols=columns, dtype=dtypes, chunksize=chunk_rows):
+        block = {
+            'trip': _category_codes(chunk['trip_id'], trips),
+            'stop': _category_codes(chunk['stop_id'], stops),
+            'seq': chunk['stop_sequence'].to_numpy(np.int32),
+            'arr': _category_codes(chunk['arrival_time'], times),
+            'dep': _category_codes(chunk['departure_time'], times),
+        }
+        del chunk  # não manter o DataFrame enquanto se lê o bloco seguinte
+        keep = block['trip'] >= 0
+        yield {k: v[keep] for k, v in block.items()}
+
+def _block_hops(block):
+    """Troços de um bloco com viagens completas: ordena por (viagem, stop_sequence) e desloca"""
+    order = np.lexsort((block['seq'], block['trip']))
+    trip, stop, arr, dep = (block[k][order] for k in ('trip', 'stop', 'arr', 'dep'))
+    same_trip = trip[1:] == trip[:-1]
+    return {
+        'from': stop[:-1][same_trip],
+        'to': stop[1:][same_trip],
+        'trip': trip[:-1][same_trip],
+        'dep': dep[:-1][same_trip],
+        'arr': arr[1:][same_trip],
+    }
+
+def _concat_hops(parts):
+    """Junta os troços dos blocos, coluna a coluna (cada coluna dos blocos é libertada logo)"""
+    return {k: np.concatenate([p.pop(k) for p in parts]) if parts else np.empty(0, np.int32)
+            for k in ('from', 'to', 'trip', 'dep', 'arr')}
+
+def _streamed_hops(blocks, trip_index):
+    """
+    Troços bloco a bloco, para stop_times agrupados por viagem (o habitual
+    nos feeds GTFS): as viagens completas de cada bloco são convertidas e
+    libertadas logo; só a última, que pode continuar no bloco seguinte,
+    passa para ele. Devolve None se uma viagem reaparecer depois de
+    convertida (ficheiro não agrupado).
+    """
+    parts = []
+    done = np.zeros(0, dtype=bool)  # viagens já convertidas (código → bool)
+    carry = None
+    for block in blocks:
+        if carry is not None:
+            block = {k: np.concatenate([carry[k], block[k]]) for k in _STOP_TIME_FIELDS}
+        if len(block['trip']) == 0:
+            continue
+        if len(done) < len(trip_index):
+            done = np.concatenate([done, np.zeros(len(trip_index) - len(done), dtype=bool)])
+        if done[block['trip']].any():
+            return None
+
+        open_trip = block['trip'] == block['trip'][-1]
+        carry = {k: v[open_trip] for k, v in block.items()}
+        complete = {k: v[~open_trip] for k, v in block.items()}
+        done[complete['trip']] = True
+        parts.append(_block_hops(complete))
+    if carry is not None:
+        parts.append(_block_hops(carry))
+    return _concat_hops(parts)
+
+def create_edges(stop_times_file, node_index, trip_index, chunk_rows=STOP_TIMES_CHUNK_ROWS):
+    """
+    Troços entre paragens consecutivas de cada viagem, em arrays.
+    O stop_times.txt é lido por blocos de chunk_rows linhas (ver
+    _stop_time_blocks); trip_index é partilhado entre operadores. Em cada
+    bloco, depois de ordenar por (viagem, stop_sequence), os troços saem de
+    um único deslocamento dos arrays. Se o ficheiro estiver agrupado por
+    viagem, cada bloco é convertido e libertado antes do seguinte, pelo que
+    a memória da leitura não depende do tamanho do feed (só o resultado,
+    um troço por linha, cresce com ele); senão, os blocos são juntos e
+    ordenados de uma vez (memória proporcional ao nº de linhas).
+    Devolve {'from', 'to', 'trip', 'dep', 'arr'} com os troços agrupados
+    por viagem e ordenados pela sequência.
+    """
+    feed = os.path.basename(os.path.dirname(stop_times_file))
+    hops = _streamed_hops(_stop_time_blocks(stop_times_file, node_index, trip_index, chunk_rows), trip_index)
+    if hops is None:
+        log.info("stop_times (%s) não está agrupado por viagem: ordenação global", feed)
+        blocks = list(_stop_time_blocks(stop_times_file, node_index, trip_index, chunk_rows))
+        hops = _block_hops({k: np.concatenate([b[k] for b in blocks]) if blocks else np.empty(0, np.int32)
+                            for k in _STOP_TIME_FIELDS})
+    log.info("Troços criados (%s): %d", feed, len(hops['trip']))
+    return hops
+
+def _pair_lookup(from_idx, to_idx, pairs, n_nodes):
+    """
+    Valor de cada par (from, to) dos troços num dicionário {(nó, nó): valor}
+    de ids inteiros, por pesquisa binária; -1 se o par não existir.
+    """
+    result = np.full(len(from_idx), -1, dtype=np.int64)
+    if not pairs:
+        return result
+    keys = np.array([a * n_nodes + b for a, b in pairs], dtype=np.int64)
+    values = np.array(list(pairs.values()), dtype=np.int64)
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    hop_keys = from_idx.astype(np.int64) * n_nodes + to_idx
+    pos = np.minimum(np.searchsorted(keys, hop_keys), len(keys) - 1)
+    found = (keys[pos] == hop_keys) & (from_idx >= 0) & (to_idx >= 0)
+    result[found] = values[pos[found]]
+    return result
+
+def read_calendar(calendar_file, calendar_dates_file):
+    """Calendário GTFS como listas de registos (serializáveis no snapshot)"""
+    import pandas as pd
+
+    calendar = pd.read_csv(calendar_file, dtype={'service_id': str})
+    calendar_dates = pd.read_csv(calendar_dates_file, dtype={'service_id': str})
+    return {
+        'calendar': [
+            {k: (v if k == 'service_id' else int(v)) for k, v in r.items()}
+            for r in calendar.to_dict('records')
+        ],
+        'calendar_dates': [
+            {'service_id': r['service_id'], 'date': int(r['date']), 'exception_type': int(r['exception_type'])}
+            for r in calendar_dates.to_dict('records')
+        ],
+    }
+
+# -----------------------------
+# --- Compilar o grafo multimodal
+# -----------------------------
+def build_graph(stcp_path=STCP_PATH, metro_path=METRO_PATH):
+    """
+    Lê os feeds GTFS e compila o grafo multimodal em arrays:
+    - nós (paragens STCP, Metro e clusters multimodais) com posição e operador
+    - pertença paragem → cluster multimodal
+    - ligações distintas (from, to, route, operator), já com os clusters
+    - troços por viagem (hops) com trip/fare/transfer, horas de partida/chegada
+      (segundos desde o início do dia de serviço) e posição na viagem,
+      ordenados por ligação
+    Devolve (arrays, meta) no formato guardado por graph_snapshot.
+    """
+    import pandas as pd
+
+    # Carregar stops
+    stcp_stops = pd.read_csv(f"{stcp_path}/stops.txt", dtype={'stop_id': str})
+    metro_stops = pd.read_csv(f"{metro_path}/stops.txt", dtype={'stop_id': str})
+
+    log.info("Número de paragens STCP: %d", len(stcp_stops))
+    log.info("Número de paragens Metro: %d", len(metro_stops))
+    log.info("Total de paragens: %d", len(stcp_stops) + len(metro_stops))
+
+    # Criar clusters multimodais
+    multimodal_clusters = []
+    mm_id_counter = 1
+
+    stcp_index = SpatialIndex(stcp_stops['stop_lat'].to_numpy(float), stcp_stops['stop_lon'].to_numpy(float))
+
+    for metro in metro_stops.to_dict('records'):
+        close_idx, _ = stcp_index.radius(metro['stop_lat'], metro['stop_lon'], MAX_DISTANCE_KM)
+        close_stcp = stcp_stops.iloc[close_idx]
+
+        if not close_stcp.empty:
+            mm_id = f"M{mm_id_counter:03d}"
+            mm_id_counter += 1
+            multimodal_clusters.append({
+                'multimodal_id': mm_id,
+                'lat': (close_stcp['stop_lat'].sum() + metro['stop_lat']) / (len(close_stcp)+1),
+                'lon': (close_stcp['stop_lon'].sum() + metro['stop_lon']) / (len(close_stcp)+1),
+                'stcp_stops': close_stcp['stop_id'].tolist(),
+                'metro_stops': [metro['stop_id']]
             })
 
-    print(f"Arestas {operator} criadas:", len(edges))
-    return edges
-
-edges_stcp = create_edges(f"{STCP_PATH}/stop_times.txt", "STCP", stcp_trip_to_route, stcp_trip_to_service)
-edges_metro = create_edges(f"{METRO_PATH}/stop_times.txt", "Metro", metro_trip_to_route, metro_trip_to_service)
+    log.info("Nós multimodais criados: %d", len(multimodal_clusters))
+
+    # Tabela de nós (mesma ordem que all_nodes)
+    node_ids = (
+        stcp_stops['stop_id'].tolist()
+        + metro_stops['stop_id'].tolist()
+        + [c['multimodal_id'] for c in multimodal_clusters]
+    )
+    node_index = {n: i for i, n in enumerate(node_ids)}
+    node_lon = np.concatenate([
+        stcp_stops['stop_lon'].to_numpy(float),
+        metro_stops['stop_lon'].to_numpy(float),
+        np.array([c['lon'] for c in multimodal_clusters], dtype=float),
+    ])
+    node_lat = np.concatenate([
+        stcp_stops['stop_lat'].to_numpy(float),
+        metro_stops['stop_lat'].to_numpy(float),
+        np.array([c['lat'] for c in multimodal_clusters], dtype=float),
+    ])
+    node_operator = np.concatenate([
+        np.full(len(stcp_stops), OP_STCP, dtype=np.int8),
+        np.full(len(metro_stops), OP_METRO, dtype=np.int8),
+        np.full(len(multimodal_clusters), OP_MULTIMODAL, dtype=np.int8),
+    ])
+
+    # Pertença paragem → cluster
+    member_stop, member_cluster = [], []
+    for c in multimodal_clusters:
+        for s in c['stcp_stops'] + c['metro_stops']:
+            member_stop.append(node_index[s])
+            member_cluster.append(node_index[c['multimodal_id']])
+
+    # Carregar trips (route_id e service_id)
+    id_cols = {'trip_id': str, 'route_id': str, 'service_id': str}
+    stcp_trips = pd.read_csv(f"{stcp_path}/trips.txt", dtype=id_cols)
+    metro_trips = pd.read_csv(f"{metro_path}/trips.txt", dtype=id_cols)
+
+    # Troços entre paragens consecutivas (códigos de trip partilhados pelos dois feeds)
+    provisional = {}
+    feeds = [
+        (OP_STCP, create_edges(f"{stcp_path}/stop_times.txt", node_index, provisional), stcp_trips),
+        (OP_METRO, create_edges(f"{metro_path}/stop_times.txt", node_index, provisional), metro_trips),
+    ]
 
-all_edges = edges_stcp + edges_metro
-print("Total de arestas combinadas:", len(all_edges))
+    # Carregar Transfers e Fares
+    stcp_transfers = pd.read_csv(f"{stcp_path}/transfers.txt", dtype={'from_stop_id': str, 'to_stop_id': str})
+    metro_fare_rules = pd.read_csv(f"{metro_path}/fare_rules.txt", encoding='utf-8-sig')
+
+    transfer_map = {
+        (r['from_stop_id'], r['to_stop_id']): int(r['transfer_type'])
+        for r in stcp_transfers.to_dict('records')
+    }
+    fare_map = {
+        (r['origin_id'], r['destination_id']): r['fare_id']
+        for r in metro_fare_rules.to_dict('records')
+    }
+
+    # Tabelas de trips / rotas / serviços / fares (só trips com troços, ordenadas pelo id)
+    provisional_ids = list(provisional)
+    used = np.unique(np.concatenate([hops['trip'] for _, hops, _ in feeds]))
+    trip_ids = sorted(provisional_ids[c] for c in used.tolist())
+    trip_rank = np.full(len(provisional_ids), -1, dtype=np.int32)
+    trip_rank[[provisional[t] for t in trip_ids]] = np.arange(len(trip_ids), dtype=np.int32)
+
+    trip_attrs = {}  # trip → (route, serviço, operador); o último feed ganha
+    for op, hops, trips in feeds:
+        to_route = dict(zip(trips['trip_id'], trips['route_id']))
+        to_service = dict(zip(trips['trip_id'], trips['service_id']))
+        for c in np.unique(hops['trip']).tolist():
+            t = provisional_ids[c]
+            trip_attrs[t] = (str(to_route.get(t)), str(to_service.get(t)), op)
+
+    route_ids = sorted({a[0] for a in trip_attrs.values()})
+    route_index = {r: i for i, r in enumerate(route_ids)}
+    service_ids = sorted({a[1] for a in trip_attrs.values()})
+    service_index = {s: i for i, s in enumerate(service_ids)}
+    fare_ids = sorted(set(fare_map.values()))
+    fare_index = {f: i for i, f in enumerate(fare_ids)}
+
+    trip_route = np.array([route_index[trip_attrs[t][0]] for t in trip_ids], dtype=np.int32)
+    trip_service = np.array([service_index[trip_attrs[t][1]] for t in trip_ids], dtype=np.int32)
+    trip_operator = np.array([trip_attrs[t][2] for t in trip_ids], dtype=np.int8)
+
+    # Pares de paragens (ids inteiros) com transfer / fare
+    def index_pairs(mapping, value_fn):
+        return {
+            (node_index[a], node_index[b]): value_fn(v)
+            for (a, b), v in mapping.items() if a in node_index and b in node_index
+        }
+    transfer_pairs = index_pairs(transfer_map, int)
+    fare_pairs = index_pairs(fare_map, fare_index.get)
+
+    # Troços dos dois feeds (STCP primeiro), viagens pela ordem dos ids
+    columns = {k: [] for k in ('from', 'to', 'trip', 'dep', 'arr', 'fare', 'transfer')}
+    for op, hops, _ in feeds:
+        rank = trip_rank[hops['trip']]
+        order = np.argsort(rank, kind='stable')
+        hop_from, hop_to = hops['from'][order], hops['to'][order]
+        none = np.full(len(order), -1, dtype=np.int64)
+        columns['from'].append(hop_from)
+        columns['to'].append(hop_to)
+        columns['trip'].append(rank[order])
+        columns['dep'].append(hops['dep'][order])
+        columns['arr'].append(hops['arr'][order])
+        # Atribuir fares / transfers às arestas originais
+        is_stcp = op == OP_STCP
+        columns['transfer'].append(_pair_lookup(hop_from, hop_to, transfer_pairs, len(node_ids)) if is_stcp else none)
+        columns['fare'].append(none if is_stcp else _pair_lookup(hop_from, hop_to, fare_pairs, len(node_ids)))
+
+    hop_from = np.concatenate(columns['from']).astype(np.int32)
+    hop_to = np.concatenate(columns['to']).astype(np.int32)
+    hop_trip = np.concatenate(columns['trip']).astype(np.int32)
+    hop_dep = np.concatenate(columns['dep']).astype(np.int32)
+    hop_arr = np.concatenate(columns['arr']).astype(np.int32)
+    hop_fare = np.concatenate(columns['fare']).astype(np.int16)
+    hop_transfer = np.concatenate(columns['transfer']).astype(np.int8)
+    log.info("Total de troços combinados: %d", len(hop_trip))
+
+    # Posição de cada troço na sua viagem (pela stop_sequence); desempata
+    # troços com a mesma hora (ex.: horários arredondados ao minuto)
+    by_trip = np.argsort(hop_trip, kind='stable')
+    trip_start = np.searchsorted(hop_trip[by_trip], hop_trip[by_trip])
+    hop_seq = np.empty(len(hop_trip), dtype=np.int32)
+    hop_seq[by_trip] = np.arange(len(hop_trip)) - trip_start
+
+    # Troços com paragens desconhecidas não entram no grafo
+    valid = (hop_from >= 0) & (hop_to >= 0)
+    hop_from, hop_to, hop_trip = hop_from[valid], hop_to[valid], hop_trip[valid]
+    hop_fare, hop_transfer = hop_fare[valid], hop_transfer[valid]
+    hop_dep, hop_arr, hop_seq = hop_dep[valid], hop_arr[valid], hop_seq[valid]
+    member_stop = np.array(member_stop, dtype=np.int32)
+    member_cluster = np.array(member_cluster, dtype=np.int32)
+
+    # Ligações deduplicadas
+    links, hop_order = compile_links(
+        hop_from, hop_to, hop_trip, trip_route, trip_operator, trip_service,
+        member_stop, member_cluster, len(node_ids)
+    )
+    log.info("Ligações distintas: %d", len(links['link_from']))
+
+    arrays = {
+        'node_ids': np.array(node_ids, dtype=str),
+        'node_lon': node_lon,
+        'node_lat': node_lat,
+        'node_operator': node_operator,
+        'member_stop': member_stop,
+        'member_cluster': member_cluster,
+        'trip_ids': np.array(trip_ids, dtype=str),
+        'trip_route': trip_route,
+        'trip_service': trip_service,
+        'trip_operator': trip_operator,
+        'route_ids': np.array(route_ids, dtype=str),
+        'service_ids': np.array(service_ids, dtype=str),
+        'fare_ids': np.array(fare_ids, dtype=str),
+        'hop_from': hop_from[hop_order],
+        'hop_to': hop_to[hop_order],
+        'hop_trip': hop_trip[hop_order],
+        'hop_fare': hop_fare[hop_order],
+        'hop_transfer': hop_transfer[hop_order],
+        'hop_dep': hop_dep[hop_order],
+        'hop_arr': hop_arr[hop_order],
+        'hop_seq': hop_seq[hop_order],
+        **links,
+    }
+    meta = {
+        'calendars': {
+            'STCP': read_calendar(f"{stcp_path}/calendar.txt", f"{stcp_path}/calendar_dates.txt"),
+            'Metro': read_calendar(f"{metro_path}/calendar.txt", f"{metro_path}/calendar_dates.txt"),
+        }
+    }
+    return arrays, meta
+
+@metrics.timed('graph_load')
+def load_graph(stcp_path=STCP_PATH, metro_path=METRO_PATH, rebuild=False):
+    """Carrega o grafo compilado do snapshot (compilando-o só se o feed mudou)"""
+    return graph_snapshot.load_or_build(
+        feed_files(stcp_path, metro_path),
+        lambda: build_graph(stcp_path, metro_path),
+        rebuild=rebuild
+    )
+
+# -----------------------------
+# --- Carregar grafo compilado
+# -----------------------------
+# Executar este ficheiro diretamente força a recompilação do snapshot (com diagnósticos)
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+graph_arrays, graph_meta = load_graph(rebuild=__name__ == "__main__")
+links = LinkTable(graph_arrays)
 
 # -----------------------------
 # --- Posições dos nós
 # -----------------------------
-node_positions = {}
-for _, r in stcp_stops.iterrows():
-    node_positions[r['stop_id']] = (r['stop_lon'], r['stop_lat'])
-for _, r in metro_stops.iterrows():
-    node_positions[r['stop_id']] = (r['stop_lon'], r['stop_lat'])
-
-# -----------------------------
-# --- Carregar Transfers e Fares
-# -----------------------------
-stcp_transfers = pd.read_csv(f"{STCP_PATH}/transfers.txt")
-metro_fare_rules = pd.read_csv(f"{METRO_PATH}/fare_rules.txt")
+all_nodes = graph_arrays['node_ids'].tolist()
+node_positions = dict(zip(
+    all_nodes,
+    zip(graph_arrays['node_lon'].tolist(), graph_arrays['node_lat'].tolist())
+))
 
-transfer_map = {
-    (r['from_stop_id'], r['to_stop_id']): r['transfer_type']
-    for _, r in stcp_transfers.iterrows()
-}
-
-fare_map = {
-    (r['origin_id'], r['destination_id']): r['fare_id']
-    for _, r in metro_fare_rules.iterrows()
-}
-
-# -----------------------------
-# --- Atribuir fares / transfers às arestas originais
-# -----------------------------
-for e in all_edges:
-    if e['operator'] == 'STCP':
-        e['transfer'] = transfer_map.get((e['from'], e['to']))
-        e['fare'] = None
-    else:
-        e['fare'] = fare_map.get((e['from'], e['to']))
-        e['transfer'] = None
+# Índice espacial de todos os nós (procura de paragens próximas)
+stop_index = SpatialIndex(graph_arrays['node_lat'], graph_arrays['node_lon'], ids=all_nodes)
 
 # -----------------------------
-# --- Criar clusters multimodais
+# --- Clusters multimodais
 # -----------------------------
 multimodal_clusters = []
-stcp_stops['is_multimodal'] = False
-metro_stops['is_multimodal'] = False
-mm_id_counter = 1
-
-for _, metro in metro_stops.iterrows():
-    close_stcp = stcp_stops[
-        stcp_stops.apply(
-            lambda r: haversine_distance(r['stop_lat'], r['stop_lon'], metro['stop_lat'], metro['stop_lon']) <= MAX_DISTANCE_KM,
-            axis=1
-        )
-    ]
-
-    if not close_stcp.empty:
-        mm_id = f"M{mm_id_counter:03d}"
-        mm_id_counter += 1
-        multimodal_clusters.append({
-            'multimodal_id': mm_id,
-            'lat': (close_stcp['stop_lat'].sum() + metro['stop_lat']) / (len(close_stcp)+1),
-            'lon': (close_stcp['stop_lon'].sum() + metro['stop_lon']) / (len(close_stcp)+1),
-            'stcp_stops': close_stcp['stop_id'].tolist(),
-            'metro_stops': [metro['stop_id']]
-        })
-        stcp_stops.loc[close_stcp.index, 'is_multimodal'] = True
-        metro_stops.loc[metro_stops['stop_id'] == metro['stop_id'], 'is_multimodal'] = True
-
-print("Nós multimodais criados:", len(multimodal_clusters))
-
-# -----------------------------
-# --- Mapear stops → multimodal
-# -----------------------------
 mm_mapping = {}
-for c in multimodal_clusters:
-    for s in c['stcp_stops'] + c['metro_stops']:
-        mm_mapping[s] = c['multimodal_id']
-    node_positions[c['multimodal_id']] = (c['lon'], c['lat'])
-
-# -----------------------------
-# --- Atualizar arestas
-# -----------------------------
-updated_edges = []
-for e in all_edges:
-    updated_edges.append({
-        'from': mm_mapping.get(e['from'], e['from']),
-        'to': mm_mapping.get(e['to'], e['to']),
-        'operator': e['operator'],
-        'trip_id': e['trip_id'],
-        'route_id': e['route_id'],
-        'service_id': e['service_id'],
-        'fare': e['fare'],
-        'transfer': e['transfer']
-    })
-
-# Ligações multimodais (a pé)
-for c in multimodal_clusters:
-    for s in c['stcp_stops'] + c['metro_stops']:
-        updated_edges.append({'from': s, 'to': c['multimodal_id'], 'operator': 'LINK', 'trip_id': None, 'route_id': None, 'service_id': None, 'fare': None, 'transfer': None})
-        updated_edges.append({'from': c['multimodal_id'], 'to': s, 'operator': 'LINK', 'trip_id': None, 'route_id': None, 'service_id': None, 'fare': None, 'transfer': None})
+_clusters_by_node = {}
+for s, c in zip(graph_arrays['member_stop'].tolist(), graph_arrays['member_cluster'].tolist()):
+    if c not in _clusters_by_node:
+        lon, lat = node_positions[all_nodes[c]]
+        _clusters_by_node[c] = {
+            'multimodal_id': all_nodes[c], 'lat': lat, 'lon': lon,
+            'stcp_stops': [], 'metro_stops': []
+        }
+        multimodal_clusters.append(_clusters_by_node[c])
+    key = 'stcp_stops' if graph_arrays['node_operator'][s] == OP_STCP else 'metro_stops'
+    _clusters_by_node[c][key].append(all_nodes[s])
+    mm_mapping[all_nodes[s]] = all_nodes[c]
 
 # -----------------------------
-# --- Lista final de nós
+# --- Carregar calendars
 # -----------------------------
-all_nodes = list(stcp_stops['stop_id']) + list(metro_stops['stop_id']) + [c['multimodal_id'] for c in multimodal_clusters]
+stcp_calendar = graph_meta['calendars']['STCP']['calendar']
+stcp_calendar_dates = graph_meta['calendars']['STCP']['calendar_dates']
+metro_calendar = graph_meta['calendars']['Metro']['calendar']
+metro_calendar_dates = graph_meta['calendars']['Metro']['calendar_dates']
+
+# Serviços ativos por data, pré-calculados para todo o período do feed
+service_calendar = ServiceCalendar(graph_meta['calendars'], graph_arrays['service_ids'])
 
 # -----------------------------
 # --- Funções de calendar-aware
 # -----------------------------
-def active_services_on_date(date, calendar, calendar_dates):
-    """
-    Retorna o conjunto de service_id ativos numa data.
-    date: datetime.date
-    """
-    active = set()
-    weekday_str = ['monday','tuesday','wednesday','thursday','friday','saturday','sunday'][date.weekday()]
-
-    for _, r in calendar.iterrows():
-        if r['start_date'] <= int(date.strftime("%Y%m%d")) <= r['end_date']:
-            if r[weekday_str] == 1:
-                active.add(r['service_id'])
-
-    for _, r in calendar_dates.iterrows():
-        if int(r['date']) == int(date.strftime("%Y%m%d")):
-            if r['exception_type'] == 1:
-                active.add(r['service_id'])
-            elif r['exception_type'] == 2:
-                active.discard(r['service_id'])
-    return active
-
 def filter_edges_by_service(edges, active_services):
     """Mantém apenas arestas com service_id ativo (ou walks/links)"""
     return [e for e in edges if (e.get('service_id') in active_services) or e['operator'] in ('LINK', 'WALK')]
 
 # -----------------------------
-# --- Carregar calendars
-# -----------------------------
-stcp_calendar = pd.read_csv(f"{STCP_PATH}/calendar.txt")
-stcp_calendar_dates = pd.read_csv(f"{STCP_PATH}/calendar_dates.txt")
-metro_calendar = pd.read_csv(f"{METRO_PATH}/calendar.txt")
-metro_calendar_dates = pd.read_csv(f"{METRO_PATH}/calendar_dates.txt")
-
-# Exemplo: filtrar arestas para uma data específica
-today = datetime.today().date()
-active_stcp = active_services_on_date(today, stcp_calendar, stcp_calendar_dates)
-active_metro = active_services_on_date(today, metro_calendar, metro_calendar_dates)
-active_services = active_stcp.union(active_metro)
-
-edges_today = filter_edges_by_service(updated_edges, active_services)
+# --- Listas de arestas (compatibilidade)
+# -----------------------------
+def _build_edge_lists():
+    """Reconstrói all_edges / updated_edges (uma dict por troço) a partir dos arrays"""
+    a = graph_arrays
+    hop_link = links.hop_links()
+    link_from = a['link_from'].tolist()
+    link_to = a['link_to'].tolist()
+    trip_ids = a['trip_ids'].tolist()
+    route_ids = a['route_ids'].tolist()
+    service_ids = a['service_ids'].tolist()
+    fare_ids = a['fare_ids'].tolist()
+    trip_route = a['trip_route'].tolist()
+    trip_service = a['trip_service'].tolist()
+    trip_operator = a['trip_operator'].tolist()
+
+    all_edges, updated_edges = [], []
+    for f, t, trip, fare, transfer, k in zip(a['hop_from'].tolist(), a['hop_to'].tolist(), a['hop_trip'].tolist(),
+                                             a['hop_fare'].tolist(), a['hop_transfer'].tolist(), hop_link.tolist()):
+        operator = OPERATORS[trip_operator[trip]]
+        e = {
+            'from': all_nodes[f],
+            'to': all_nodes[t],
+            'trip_id': trip_ids[trip],
+            'route_id': route_ids[trip_route[trip]],
+            'service_id': service_ids[trip_service[trip]],
+            'operator': operator,
+            'fare': fare_ids[fare] if fare >= 0 else None,
+            'transfer': transfer if transfer >= 0 else None,
+        }
+        all_edges.append(e)
+        updated_edges.append({**e, 'from': all_nodes[link_from[k]], 'to': all_nodes[link_to[k]]})
+
+    # Ligações multimodais (a pé)
+    for c in multimodal_clusters:
+        for s in c['stcp_stops'] + c['metro_stops']:
+            updated_edges.append({'from': s, 'to': c['multimodal_id'], 'operator': 'LINK', 'trip_id': None, 'route_id': None, 'service_id': None, 'fare': None, 'transfer': None})
+            updated_edges.append({'from': c['multimodal_id'], 'to': s, 'operator': 'LINK', 'trip_id': None, 'route_id': None, 'service_id': None, 'fare': None, 'transfer': None})
+
+    return all_edges, updated_edges
+
+def _build_edges_today():
+    today = datetime.today().date()
+    return filter_edges_by_service(__getattr__('updated_edges'), service_calendar.active_services(today))
+
+_lazy = {}
+
+def __getattr__(name):
+    """
+    As listas de dicts só são materializadas quando alguém as importa,
+    para que o arranque a partir do snapshot não pague esse custo.
+    """
+    if name in ('all_edges', 'updated_edges'):
+        if 'updated_edges' not in _lazy:
+            _lazy['all_edges'], _lazy['updated_edges'] = _build_edge_lists()
+        return _lazy[name]
+    if name == 'edges_today':
+        if name not in _lazy:
+            _lazy[name] = _build_edges_today()
+        return _lazy[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -----------------------------
 # --- VERIFICAÇÃO GTFS-AWARE
 # -----------------------------
-nodes_without_position = [n for n in all_nodes if n not in node_positions]
-edges_invalid = [e for e in edges_today if e['from'] not in node_positions or e['to'] not in node_positions]
+def verify_graph():
+    edges_today = __getattr__('edges_today')
+    nodes_without_position = [n for n in all_nodes if n not in node_positions]
+    edges_invalid = [e for e in edges_today if e['from'] not in node_positions or e['to'] not in node_positions]
 
-print("\n=== VERIFICAÇÃO COMPLETA DO GRAFO ===")
-print("Total de nós:", len(all_nodes))
-print("Nós multimodais:", len(multimodal_clusters))
-print("Nós sem posição:", len(nodes_without_position))
-print("Arestas totais:", len(edges_today))
-print("Arestas inválidas:", len(edges_invalid))
-print("=== VERIFICAÇÃO CONCLUÍDA ===")
+    print("\n=== VERIFICAÇÃO COMPLETA DO GRAFO ===")
+    print("Total de nós:", len(all_nodes))
+    print("Nós multimodais:", len(multimodal_clusters))
+    print("Nós sem posição:", len(nodes_without_position))
+    print("Arestas totais:", len(edges_today))
+    print("Arestas inválidas:", len(edges_invalid))
+    print("=== VERIFICAÇÃO CONCLUÍDA ===")
+
+if __name__ == "__main__":
+    verify_graph()
 
 # -----------------------------
 # --- Plot
 # -----------------------------
 '''
+import matplotlib.pyplot as plt
+
+stcp = [n for n, op in zip(all_nodes, graph_arrays['node_operator']) if op == OP_STCP]
+metro = [n for n, op in zip(all_nodes, graph_arrays['node_operator']) if op == OP_METRO]
 plt.figure(figsize=(12, 10))
-plt.scatter(stcp_stops['stop_lon'], stcp_stops['stop_lat'], s=10, c='blue', label='STCP')
-plt.scatter(metro_stops['stop_lon'], metro_stops['stop_lat'], s=20, c='green', label='Metro')
+plt.scatter([node_positions[n][0] for n in stcp], [node_positions[n][1] for n in stcp], s=10, c='blue', label='STCP')
+plt.scatter([node_positions[n][0] for n in metro], [node_positions[n][1] for n in metro], s=20, c='green', label='Metro')
 for c in multimodal_clusters:
     plt.scatter(c['lon'], c['lat'], c='red', s=50)
 plt.legend()
@@ -0,0 +1,199 @@
+# graph_snapshot.py
+
+"""
+Snapshot persistente do grafo multimodal compilado.
+
+O grafo é compilado uma única vez a partir dos ficheiros GTFS e guardado
+numa pasta versionada (um ficheiro .npy por array + meta.json), identificada
+por um hash do conteúdo dos ficheiros do feed. Ao arrancar, os arrays são
+abertos em memory-map, pelo que o custo de arranque é de milissegundos e o
+parse do GTFS só volta a acontecer quando o feed muda.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import numpy as np
+
+# Incrementar sempre que o formato dos arrays compilados mudar
+SNAPSHOT_VERSION = 4
+
+# Pasta dos snapshots (CIN_CACHE_DIR permite usar outra, ex.: nos benchmarks)
+CACHE_DIR = os.environ.get(
+    "CIN_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "Dataset", ".cache")
+)
+
+# Índice (caminho, tamanho, mtime) -> hash, para não reler o feed em cada arranque
+FINGERPRINT_INDEX = "fingerprints.json"
+
+# Nome das pastas de snapshot (ver snapshot_path)
+_SNAPSHOT_DIR = re.compile(r"graph_v\d+_[0-9a-f]+")
+
+
+# -----------------------------
+# --- Hash do feed
+# -----------------------------
+def _file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def feed_fingerprint(feed_files, cache_dir=CACHE_DIR):
+    """
+    Hash do conteúdo dos ficheiros do feed (e da versão do snapshot).
+    O hash de cada ficheiro é memorizado por (tamanho, mtime), pelo que
+    só é recalculado quando o ficheiro muda.
+    """
+    index_path = os.path.join(cache_dir, FINGERPRINT_INDEX)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    h = hashlib.sha256(f"snapshot-v{SNAPSHOT_VERSION}".encode())
+    changed = False
+    for path in feed_files:
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        entry = index.get(key)
+        if entry is None or entry['stamp'] != stamp:
+            entry = {'stamp': stamp, 'sha256': _file_digest(path)}
+            index[key] = entry
+            changed = True
+        h.update(os.path.basename(path).encode())
+        h.update(entry['sha256'].encode())
+
+    if changed:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = index_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+    return h.hexdigest()[:16]
+
+
+def feed_id(feed_files):
+    """
+    Identificador do feed pelos caminhos dos seus ficheiros (não pelo conteúdo):
+    é o mesmo para todas as versões de um feed, e distingue feeds diferentes
+    que partilham a mesma pasta de snapshots.
+    """
+    h = hashlib.sha256("\n".join(os.path.abspath(p) for p in feed_files).encode())
+    return h.hexdigest()[:16]
+
+
+# -----------------------------
+# --- Guardar / carregar
+# -----------------------------
+def snapshot_path(fingerprint, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"graph_v{SNAPSHOT_VERSION}_{fingerprint}")
+
+
+def save_snapshot(path, arrays, meta, feed=None):
+    """
+    Grava os arrays (um .npy cada) e os metadados JSON (com o feed_id do
+    feed de origem, se dado, para prune_snapshots).
+    A escrita é feita numa pasta temporária e depois renomeada,
+    para que um processo concorrente nunca veja um snapshot incompleto.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(arr), allow_pickle=False)
+
+    with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+        header = {'version': SNAPSHOT_VERSION, 'arrays': sorted(arrays), 'meta': meta}
+        if feed is not None:
+            header['feed'] = feed
+        json.dump(header, f)
+
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Outro processo gravou o mesmo snapshot entretanto
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_snapshot(path, mmap=True):
+    """
+    Abre um snapshot. Com mmap=True os arrays ficam em memory-map (só de leitura)
+    e são partilhados entre processos pelo page cache do sistema operativo.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        header = json.load(f)
+    if header['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f"Versão de snapshot incompatível: {header['version']}")
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in header['arrays']
+    }
+    return arrays, header['meta']
+
+
+def _snapshot_feed(path):
+    """feed_id gravado no meta.json de um snapshot (None se não houver)"""
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f).get('feed')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def prune_snapshots(keep, feed, cache_dir=CACHE_DIR):
+    """
+    Apaga as pastas de snapshot de cache_dir do mesmo feed (feed_id) que não
+    são keep, ou seja, de versões anteriores do formato ou do feed, com tudo
+    o que está dentro delas (ex.: as tabelas alt/ dos landmarks). Snapshots
+    de outros feeds (ex.: com um CIN_CACHE_DIR partilhado) ou sem feed_id
+    não são tocados. Devolve os nomes das pastas apagadas.
+    """
+    keep = os.path.basename(keep)
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return []
+    removed = []
+    for name in sorted(names):
+        path = os.path.join(cache_dir, name)
+        if name == keep or not _SNAPSHOT_DIR.fullmatch(name) or not os.path.isdir(path):
+            continue
+        if _snapshot_feed(path) == feed:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+def load_or_build(feed_files, build_fn, cache_dir=CACHE_DIR, rebuild=False, mmap=True):
+    """
+    Devolve (arrays, meta) do snapshot correspondente ao feed atual.
+    Se não existir (ou rebuild=True), chama build_fn() -> (arrays, meta) e grava-o;
+    os snapshots anteriores do mesmo feed (outra versão ou outro conteúdo)
+    são então apagados.
+    """
+    path = snapshot_path(feed_fingerprint(feed_files, cache_dir), cache_dir)
+
+    if not rebuild and os.path.isdir(path):
+        try:
+            return load_snapshot(path, mmap=mmap)
+        except (OSError, ValueError):
+            pass  # snapshot corrompido → recompilar
+
+    arrays, meta = build_fn()
+    shutil.rmtree(path, ignore_errors=True)
+    feed = feed_id(feed_files)
+    save_snapshot(path, arrays, meta, feed=feed)
+    prune_snapshots(path, feed, cache_dir)
+    return load_snapshot(path, mmap=mmap)
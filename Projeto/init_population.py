@@ -1,61 +1,38 @@
 # init_population.py
 
 from datetime import datetime
+from functools import lru_cache
+import numpy as np
 import routing
+import metrics
+from geometry import haversine_distance
+from Constants import WALK_EMISSION_GCO2_PER_KM
+from transit_graph import TransitGraph, QueryGraph, START_ID, END_ID
 from path_evaluation import path_objective  # Função objetivo que devolve [tempo, CO2]
 
 from graph_builder import (
     all_nodes,
-    updated_edges,
+    links,
     node_positions,
-    stcp_calendar,
-    stcp_calendar_dates,
-    metro_calendar,
-    metro_calendar_dates
+    stop_index,
+    service_calendar
 )
 
-# ============================================================
-# Serviços ativos numa data
-# ============================================================
-
-def active_services_on_date(date, calendar, calendar_dates):
-    active = set()
-    weekday_str = [
-        'monday','tuesday','wednesday',
-        'thursday','friday','saturday','sunday'
-    ][date.weekday()]
-
-    for _, r in calendar.iterrows():
-        if r['start_date'] <= int(date.strftime("%Y%m%d")) <= r['end_date']:
-            if r[weekday_str] == 1:
-                active.add(r['service_id'])
-
-    for _, r in calendar_dates.iterrows():
-        if int(r['date']) == int(date.strftime("%Y%m%d")):
-            if r['exception_type'] == 1:
-                active.add(r['service_id'])
-            elif r['exception_type'] == 2:
-                active.discard(r['service_id'])
-
-    return active
-
 # ============================================================
 # Encontrar paragens próximas a um ponto GPS
 # ============================================================
 
-def find_nearby_stops(lat, lon, node_positions, max_distance_km=0.8):
-    nearby = []
-    for stop_id, (stop_lon, stop_lat) in node_positions.items():
-        dist = routing.haversine_distance(lat, lon, stop_lat, stop_lon)
-        if dist <= max_distance_km:
-            nearby.append((stop_id, dist))
-    return nearby
+def find_nearby_stops(lat, lon, max_distance_km=0.8, index=None):
+    """[(stop_id, distância_km)] dos nós do grafo a <= max_distance_km (índice espacial)"""
+    if index is None:
+        index = stop_index
+    return index.query_radius(lat, lon, max_distance_km)
 
 # ============================================================
 # Criar arestas WALK temporárias (origem)
 # ============================================================
 
-def add_walking_edges_from_point(edges, point_id, lat, lon, nearby_stops, walk_speed_kmh=5.0):
+def add_walking_edges_from_point(point_id, nearby_stops, walk_speed_kmh=5.0):
     new_edges = []
     for stop_id, dist_km in nearby_stops:
         time_min = dist_km / walk_speed_kmh * 60
@@ -63,22 +40,18 @@ def add_walking_edges_from_point(edges, point_id, lat, lon, nearby_stops, walk_s
             'from': point_id,
             'to': stop_id,
             'operator': 'WALK',
-            'trip_id': None,
             'route_id': None,
-            'service_id': None,
-            'fare': None,
-            'transfer': None,
             'travel_time': time_min,
-            'from_pos': (lon, lat),
-            'to_pos': node_positions[stop_id]
+            'dist_km': dist_km,
+            'co2': dist_km * WALK_EMISSION_GCO2_PER_KM
         })
-    return edges + new_edges
+    return new_edges
 
 # ============================================================
 # Criar arestas WALK temporárias (destino)
 # ============================================================
 
-def add_walking_edges_to_point(edges, point_id, lat, lon, nearby_stops, walk_speed_kmh=5.0):
+def add_walking_edges_to_point(point_id, nearby_stops, walk_speed_kmh=5.0):
     new_edges = []
     for stop_id, dist_km in nearby_stops:
         time_min = dist_km / walk_speed_kmh * 60
@@ -86,73 +59,147 @@ def add_walking_edges_to_point(edges, point_id, lat, lon, nearby_stops, walk_spe
             'from': stop_id,
             'to': point_id,
             'operator': 'WALK',
-            'trip_id': None,
             'route_id': None,
-            'service_id': None,
-            'fare': None,
-            'transfer': None,
             'travel_time': time_min,
-            'from_pos': node_positions[stop_id],
-            'to_pos': (lon, lat)
+            'dist_km': dist_km,
+            'co2': dist_km * WALK_EMISSION_GCO2_PER_KM
         })
-    return edges + new_edges
+    return new_edges
+
+# ============================================================
+# Grafo do dia de serviço (construído uma vez por data)
+# ============================================================
+
+@lru_cache(maxsize=64)
+@metrics.timed('service_filter')
+def active_link_mask(date):
+    """Máscara das ligações com pelo menos uma viagem ativa na data (cache LRU)"""
+    mask = links.active_mask_for_services(service_calendar.service_mask(date))
+    mask.flags.writeable = False
+    return mask
+
+@metrics.timed('day_graph_build')
+def build_day_graph(date):
+    """TransitGraph com as ligações ativas numa data e respetivos travel_time"""
+    # Ligações (from, to, route, operator) com pelo menos uma viagem ativa,
+    # já com distância, travel_time e CO2 pré-calculados
+    edges_today = links.edge_dicts(active_link_mask(date))
+
+    return TransitGraph(all_nodes, node_positions, edges_today)
+
+@lru_cache(maxsize=8)
+def day_graph(date):
+    return build_day_graph(date)
 
 # ============================================================
 # Função principal para inicializar população
 # ============================================================
 
-def initialize_population(start_coords=(41.1780, -8.5980), end_coords=(41.1612, -8.6306)):
+def query_graph(start_coords, end_coords, date):
     """
-    Retorna o caminho inicial e o grafo utilizável hoje.
+    Grafo do pedido: grafo do dia (partilhado, não é alterado) + arestas WALK
+    temporárias de __START__ para as paragens próximas e das paragens
+    próximas para __END__.
     """
-    today = datetime.today().date()
-
-    # Serviços ativos
-    active_stcp = active_services_on_date(today, stcp_calendar, stcp_calendar_dates)
-    active_metro = active_services_on_date(today, metro_calendar, metro_calendar_dates)
-    active_services = active_stcp.union(active_metro)
-
-    # Filtrar arestas ativas
-    edges_today = [
-        e for e in updated_edges
-        if (e.get('service_id') in active_services) or e['operator'] in ('LINK', 'WALK')
-    ]
-
-    # Garantir nós válidos
-    edges_today = [
-        e for e in edges_today
-        if str(e['from']) in node_positions and str(e['to']) in node_positions
-    ]
-
-    # Adicionar posições às arestas existentes
-    for e in edges_today:
-        e['from_pos'] = node_positions[str(e['from'])]
-        e['to_pos'] = node_positions[str(e['to'])]
-
-    # Calcular travel_time
-    routing.compute_travel_time(edges_today)
-
-    # Definir nós especiais
     start_lat, start_lon = start_coords
     end_lat, end_lon = end_coords
-    START_ID = "__START__"
-    END_ID = "__END__"
-    node_positions[START_ID] = (start_lon, start_lat)
-    node_positions[END_ID] = (end_lon, end_lat)
 
     # Encontrar paragens próximas
-    nearby_start = find_nearby_stops(start_lat, start_lon, node_positions)
-    nearby_end = find_nearby_stops(end_lat, end_lon, node_positions)
-
-    # Criar arestas WALK temporárias
-    edges_augmented = edges_today.copy()
-    edges_augmented = add_walking_edges_from_point(edges_augmented, START_ID, start_lat, start_lon, nearby_start)
-    edges_augmented = add_walking_edges_to_point(edges_augmented, END_ID, end_lat, end_lon, nearby_end)
+    with metrics.timer('nearby_stops'):
+        nearby_start = find_nearby_stops(start_lat, start_lon)
+        nearby_end = find_nearby_stops(end_lat, end_lon)
+
+    # Origem e destino próximos: permitir ir diretamente a pé
+    direct_km = haversine_distance(start_lat, start_lon, end_lat, end_lon)
+    if direct_km <= 0.8:
+        nearby_start.append((END_ID, direct_km))
+
+    walk_edges = (
+        add_walking_edges_from_point(START_ID, nearby_start)
+        + add_walking_edges_to_point(END_ID, nearby_end)
+    )
+    return QueryGraph(day_graph(date), (start_lon, start_lat), (end_lon, end_lat), walk_edges)
+
+@metrics.timed('initialize_population')
+def initialize_population(start_coords=(41.1780, -8.5980), end_coords=(41.1612, -8.6306), date=None,
+                          router=None):
+    """
+    Retorna o caminho inicial (ids inteiros de nós) e o grafo do pedido na data
+    (por omissão, hoje). Não altera nenhum estado global: pode ser chamada
+    em simultâneo por várias threads.
+    router: função (graph, source, target) -> (custo, caminho); por omissão
+    routing.dijkstra (ex.: landmarks.alt_router(date) para A* com ALT).
+    """
+    if date is None:
+        date = datetime.today().date()
 
-    # Lista final de nós
-    nodes_augmented = all_nodes + [START_ID, END_ID]
+    graph = query_graph(start_coords, end_coords, date)
 
     # Routing Dijkstra
-    total_time, path = routing.dijkstra(nodes_augmented, edges_augmented, START_ID, END_ID)
+    total_time, path = (router or routing.dijkstra)(graph, graph.start, graph.end)
+
+    return path, graph
 
-    return path, nodes_augmented, edges_augmented
+# ============================================================
+# Vários caminhos iniciais (sementes do MOEA/D)
+# ============================================================
+
+def _edge_values(values):
+    """Valores por aresta num array (grafo do dia + arestas do pedido)"""
+    base = getattr(values, 'base', values)
+    extra = getattr(values, 'extra', [])
+    return np.concatenate([np.asarray(base, dtype=float), np.asarray(extra, dtype=float)])
+
+@metrics.timed('seed_paths')
+def seed_paths(graph, source, target, weight_vectors, k=None, edge_penalty=0.5, max_rounds=2,
+               fastest=None):
+    """
+    Até k caminhos distintos de source a target para a população inicial.
+    Para cada vetor de pesos (w_tempo, w_CO2) corre um dijkstra com o custo
+    w_tempo * tempo / T + w_CO2 * CO2 / C por aresta, onde T e C são o tempo
+    e o CO2 do caminho mais rápido (escalas comparáveis). As arestas de cada
+    caminho encontrado ficam (1 + edge_penalty) vezes mais caras nas
+    pesquisas seguintes, o que afasta os caminhos seguintes dos já
+    encontrados. Faz no máximo max_rounds passagens pelos vetores de pesos.
+    fastest: caminho mais rápido, se já for conhecido (evita repetir o dijkstra).
+    Devolve a lista de caminhos (o mais rápido primeiro).
+    """
+    weight_vectors = np.asarray(weight_vectors, dtype=float)
+    if k is None:
+        k = len(weight_vectors)
+
+    travel_time = _edge_values(graph.travel_time)
+    co2 = _edge_values(graph.edge_co2)
+
+    if fastest is None:
+        _, fastest = routing.dijkstra(graph, source, target)
+    if not fastest:
+        return []
+    fastest_edges = [graph.edge_between(u, v) for u, v in zip(fastest, fastest[1:])]
+    time_scale = max(float(travel_time[fastest_edges].sum()), 1e-9)
+    co2_scale = max(float(co2[fastest_edges].sum()), 1e-9)
+
+    paths = [fastest]
+    seen = {tuple(fastest)}
+    factor = np.ones(len(travel_time))
+
+    def penalize(path):
+        # Todas as arestas paralelas entre nós consecutivos do caminho
+        for u, v in zip(path, path[1:]):
+            for e, t, _ in graph.out_arcs(u):
+                if t == v:
+                    factor[e] *= 1 + edge_penalty
+
+    penalize(fastest)
+    for _ in range(max_rounds):
+        for w_time, w_co2 in weight_vectors[:, :2]:
+            if len(paths) >= k:
+                return paths
+            cost = (w_time / time_scale * travel_time + w_co2 / co2_scale * co2) * factor
+            _, path = routing.dijkstra(graph, source, target, weights=cost.tolist())
+            if path:
+                penalize(path)
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    paths.append(path)
+    return paths
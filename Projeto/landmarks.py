@@ -0,0 +1,191 @@
+# landmarks.py
+
+"""
+Pré-processamento ALT (A*, Landmarks, desigualdade triangular) por dia de serviço.
+
+Para k nós de referência (landmarks) guardam-se as distâncias de cada
+landmark a todos os nós e de todos os nós a cada landmark, no grafo do
+dia. Daí sai, para qualquer destino t, um limite inferior de d(v, t):
+
+    d(v, t) >= d(L, t) - d(L, v)      e      d(v, t) >= d(v, L) - d(t, L)
+
+muito mais apertado do que a distância em linha reta, pelo que o A*
+visita só uma pequena parte do grafo. As tabelas são gravadas dentro da
+pasta do snapshot do grafo (são apagadas com ela quando o snapshot é
+recompilado para um feed novo, ver graph_snapshot.prune_snapshots) e
+reutilizadas nos arranques seguintes; se o grafo do dia mudar (ex.:
+velocidades em Constants.py) são recalculadas e regravadas.
+"""
+
+import os
+import shutil
+from functools import lru_cache
+import numpy as np
+import graph_snapshot
+import metrics
+import routing
+from graph_builder import feed_files
+from init_population import day_graph
+
+DEFAULT_LANDMARKS = 16
+
+# Folga relativa contra arredondamentos nas diferenças de distâncias
+_SLACK = 1 - 1e-9
+
+# Distância usada no lugar de inf (evita inf - inf nas diferenças): um nó
+# inalcançável dá um limite enorme, o que está certo (o destino também o é)
+_FAR = 1e9
+
+
+# -----------------------------
+# --- Escolha e tabelas
+# -----------------------------
+def select_landmarks(graph, k=DEFAULT_LANDMARKS, seed=0):
+    """
+    Seleção "farthest": cada landmark é o nó mais afastado (em tempo) dos
+    já escolhidos. Devolve (landmarks, tabela para a frente, tabela para trás).
+    """
+    has_edges = np.diff(np.asarray(graph.offsets)) > 0
+    candidates = np.flatnonzero(has_edges)
+    rng = np.random.default_rng(seed)
+
+    start = int(rng.choice(candidates))
+    first = routing.dijkstra_all(graph, start)
+    first[~np.isfinite(first)] = -1
+    chosen = [int(first.argmax())]
+
+    forward, backward = [], []
+    closest = np.full(graph.num_nodes, np.inf)
+    while True:
+        L = chosen[-1]
+        forward.append(routing.dijkstra_all(graph, L))
+        backward.append(routing.dijkstra_all(graph, L, reverse=True))
+        if len(chosen) == k:
+            break
+        # Proximidade ao landmark mais próximo (só nós alcançáveis)
+        closest = np.minimum(closest, forward[-1])
+        score = np.where(np.isfinite(closest) & has_edges, closest, -1)
+        score[chosen] = -1
+        nxt = int(score.argmax())
+        if score[nxt] <= 0:
+            # Componente esgotada: recomeçar num nó ainda sem landmark alcançável
+            pool = np.flatnonzero(~np.isfinite(closest) & has_edges)
+            if len(pool) == 0:
+                break
+            nxt = int(rng.choice(pool))
+        chosen.append(nxt)
+
+    return np.array(chosen, dtype=np.int32), np.vstack(forward), np.vstack(backward)
+
+
+def _graph_signature(graph):
+    """Identifica o grafo do dia (invalida tabelas se os tempos das arestas mudarem)"""
+    return [graph.num_nodes, graph.num_edges, float(np.sum(graph.travel_time))]
+
+
+class LandmarkTable:
+    def __init__(self, landmarks, forward, backward):
+        """
+        landmarks: ids dos nós de referência (k,)
+        forward[i, v]: d(landmark i, v); backward[i, v]: d(v, landmark i)
+        """
+        self.landmarks = landmarks
+        self.forward = forward
+        self.backward = backward
+        self.num_nodes = forward.shape[1]
+        self._fwd = np.where(np.isfinite(forward), forward, _FAR)
+        self._bwd = np.where(np.isfinite(backward), backward, _FAR)
+        # Nós sem ligação a nenhum landmark (ex.: __START__/__END__ no grafo do dia)
+        self._unlinked = ~np.isfinite(forward).any(axis=0) & ~np.isfinite(backward).any(axis=0)
+
+    def heuristic(self, graph, target):
+        """
+        Limite inferior de d(v, target) para todos os nós do grafo (lista
+        indexável, para usar como heurística do routing.astar). Funciona com
+        o grafo do dia e com o QueryGraph de um pedido: para __END__, que só
+        existe no pedido, o limite passa pelas arestas que lá chegam.
+        """
+        fwd, bwd = self._fwd, self._bwd
+        extra_in = getattr(graph, 'extra_in', {}).get(target)
+
+        if extra_in is None:
+            to_target = fwd[:, target]    # d(L, t)
+            from_target = bwd[:, target]  # d(t, L)
+        else:
+            # d(L, t) = min_s d(L, s) + w_s ;  d(v, t) >= d(v, L) - max_s (d(s, L) - w_s)
+            sources, weights = [], []
+            for _, s, w in graph.in_arcs(target):
+                sources.append(s)
+                weights.append(w)
+            if not sources:
+                return lambda v: 0.0
+            weights = np.array(weights)
+            to_target = np.min(fwd[:, sources] + weights, axis=1)
+            from_target = np.max(bwd[:, sources] - weights, axis=1)
+
+        bound = np.maximum(
+            np.max(to_target[:, None] - fwd, axis=0),
+            np.max(bwd - from_target[:, None], axis=0),
+        )
+        bound = np.maximum(bound, 0.0) * _SLACK
+        bound[self._unlinked] = 0.0
+
+        # Nós só do pedido ficam com 0, tal como o destino
+        h = np.zeros(graph.num_nodes)
+        h[:self.num_nodes] = bound
+        h[target] = 0.0
+        return h.tolist().__getitem__
+
+    def arrays(self):
+        return {'landmarks': self.landmarks, 'forward': self.forward, 'backward': self.backward}
+
+
+# -----------------------------
+# --- Persistência
+# -----------------------------
+def table_path(date, k, cache_dir=graph_snapshot.CACHE_DIR):
+    """Pasta das tabelas de uma data, dentro da pasta do snapshot do grafo"""
+    snapshot = graph_snapshot.snapshot_path(graph_snapshot.feed_fingerprint(feed_files(), cache_dir), cache_dir)
+    return os.path.join(snapshot, "alt", f"{date:%Y%m%d}_k{k}")
+
+
+@metrics.timed('landmarks_build')
+def build_landmarks(graph, k=DEFAULT_LANDMARKS, seed=0):
+    return LandmarkTable(*select_landmarks(graph, k, seed))
+
+
+@lru_cache(maxsize=8)
+def landmarks_for_date(date, k=DEFAULT_LANDMARKS, rebuild=False):
+    """Tabelas ALT do dia: lidas da cache ou calculadas e gravadas"""
+    graph = day_graph(date)
+    path = table_path(date, k)
+    signature = _graph_signature(graph)
+
+    if not rebuild and os.path.isdir(path):
+        try:
+            arrays, meta = graph_snapshot.load_snapshot(path)
+            if meta.get('signature') == signature:
+                return LandmarkTable(arrays['landmarks'], arrays['forward'], arrays['backward'])
+        except (OSError, ValueError, KeyError):
+            pass  # tabelas corrompidas ou de outra versão → recalcular
+
+    table = build_landmarks(graph, k)
+    # save_snapshot não substitui uma pasta existente (tabelas de outro grafo)
+    shutil.rmtree(path, ignore_errors=True)
+    graph_snapshot.save_snapshot(path, table.arrays(), {'signature': signature, 'date': str(date)})
+    return table
+
+
+# -----------------------------
+# --- Routing
+# -----------------------------
+def alt_router(date, k=DEFAULT_LANDMARKS):
+    """
+    Função (graph, source, target) -> (custo, caminho) com A* + ALT, para usar
+    como router do initialize_population nos pedidos dessa data.
+    """
+    table = landmarks_for_date(date, k)
+
+    def route(graph, source, target):
+        return routing.astar(graph, source, target, heuristic=table.heuristic(graph, target))
+    return route
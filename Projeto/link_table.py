@@ -0,0 +1,181 @@
+# link_table.py
+
+"""
+Modelo compacto de arestas ao nível do padrão.
+
+Cada ligação distinta (from, to, route, operator) existe uma única vez.
+Os dados por viagem (trip, serviço, fare, transfer, horas) ficam em arrays
+colunares ordenados por ligação: as viagens da ligação k ocupam
+hop_*[link_hop_start[k]:link_hop_start[k+1]].
+"""
+
+import numpy as np
+import geometry
+
+# Códigos de operador usados nos arrays compilados (nós e ligações)
+OPERATORS = ['STCP', 'Metro', 'MULTIMODAL', 'LINK', 'WALK']
+OP_STCP, OP_METRO, OP_MULTIMODAL, OP_LINK, OP_WALK = 0, 1, 2, 3, 4
+
+
+# -----------------------------
+# --- Compilação (usada pelo graph_builder)
+# -----------------------------
+def compile_links(hop_from, hop_to, hop_trip, trip_route, trip_operator, trip_service,
+                  member_stop, member_cluster, n_nodes):
+    """
+    Deduplica os troços por viagem em ligações (from, to, route, operator),
+    já com as paragens agrupadas nos clusters multimodais, e acrescenta as
+    ligações LINK paragem ↔ cluster.
+    Devolve os arrays das ligações, a ordem dos troços por ligação e os
+    pares (ligação, serviço) distintos.
+    """
+    # Paragem → cluster (o último cluster ganha, como no mm_mapping)
+    mapped = np.arange(n_nodes, dtype=np.int32)
+    for s, c in zip(member_stop.tolist(), member_cluster.tolist()):
+        mapped[s] = c
+
+    hop_keys = np.column_stack([
+        mapped[hop_from],
+        mapped[hop_to],
+        trip_route[hop_trip].astype(np.int32),
+        trip_operator[hop_trip].astype(np.int32),
+    ])
+    member_keys = np.concatenate([
+        np.column_stack([member_stop, member_cluster]),
+        np.column_stack([member_cluster, member_stop]),
+    ]).astype(np.int32)
+    link_keys = np.column_stack([
+        member_keys,
+        np.full(len(member_keys), -1, dtype=np.int32),
+        np.full(len(member_keys), OP_LINK, dtype=np.int32),
+    ])
+
+    keys, inverse = np.unique(np.concatenate([hop_keys, link_keys]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    hop_link = inverse[:len(hop_keys)].astype(np.int32)
+
+    # Troços ordenados por ligação (estável, mantém a ordem das viagens)
+    hop_order = np.argsort(hop_link, kind='stable')
+    counts = np.bincount(hop_link, minlength=len(keys))
+    link_hop_start = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=link_hop_start[1:])
+
+    # Pares (ligação, serviço) distintos para filtrar por data sem olhar para os troços
+    pairs = np.unique(np.column_stack([hop_link, trip_service[hop_trip].astype(np.int32)]), axis=0)
+
+    links = {
+        'link_from': keys[:, 0].astype(np.int32),
+        'link_to': keys[:, 1].astype(np.int32),
+        'link_route': keys[:, 2].astype(np.int32),
+        'link_operator': keys[:, 3].astype(np.int8),
+        'link_hop_start': link_hop_start,
+        'link_service_link': pairs[:, 0].astype(np.int32),
+        'link_service_service': pairs[:, 1].astype(np.int32),
+    }
+    return links, hop_order
+
+
+# -----------------------------
+# --- Tabela de ligações
+# -----------------------------
+class LinkTable:
+    """
+    Vista sobre os arrays compilados do grafo (snapshot).
+    Não copia dados: os arrays podem estar em memory-map.
+    """
+    def __init__(self, arrays):
+        self.node_ids = arrays['node_ids']
+        self.route_ids = arrays['route_ids']
+        self.service_ids = arrays['service_ids']
+        self.trip_ids = arrays['trip_ids']
+        self.trip_service = arrays['trip_service']
+
+        self.link_from = arrays['link_from']
+        self.link_to = arrays['link_to']
+        self.link_route = arrays['link_route']
+        self.link_operator = arrays['link_operator']
+        self.link_hop_start = arrays['link_hop_start']
+        self.link_service_link = arrays['link_service_link']
+        self.link_service_service = arrays['link_service_service']
+
+        self.hop_trip = arrays['hop_trip']
+        self.hop_fare = arrays['hop_fare']
+        self.hop_transfer = arrays['hop_transfer']
+        self.hop_dep = arrays['hop_dep']
+        self.hop_arr = arrays['hop_arr']
+        self.hop_seq = arrays['hop_seq']  # posição do troço na viagem
+        self.trip_route = arrays['trip_route']
+        self.trip_operator = arrays['trip_operator']
+
+        self._service_index = {s: i for i, s in enumerate(self.service_ids.tolist())}
+
+        # Distância, tempo e CO2 de cada ligação (calculados uma vez, vetorizados)
+        lat, lon = arrays['node_lat'], arrays['node_lon']
+        self.link_dist_km, self.link_travel_time, self.link_co2 = geometry.edge_metrics(
+            lat[self.link_from], lon[self.link_from],
+            lat[self.link_to], lon[self.link_to],
+            np.array(OPERATORS)[self.link_operator]
+        )
+
+    def __len__(self):
+        return len(self.link_from)
+
+    def service_mask(self, active_services):
+        """Máscara booleana (por service_id) dos serviços ativos"""
+        mask = np.zeros(len(self.service_ids), dtype=bool)
+        idx = [self._service_index[s] for s in active_services if s in self._service_index]
+        mask[idx] = True
+        return mask
+
+    def active_mask(self, active_services):
+        """
+        Máscara booleana das ligações com pelo menos uma viagem
+        num serviço ativo. Ligações LINK/WALK estão sempre ativas.
+        """
+        return self.active_mask_for_services(self.service_mask(active_services))
+
+    def active_mask_for_services(self, service_mask):
+        """Como active_mask, a partir de uma máscara por service_id (ServiceCalendar)"""
+        mask = self.link_operator >= OP_LINK
+        active_pairs = service_mask[self.link_service_service]
+        mask[self.link_service_link[active_pairs]] = True
+        return mask
+
+    def hop_links(self):
+        """Ligação de cada troço (os troços estão ordenados por ligação)"""
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.link_hop_start))
+
+    def trips(self, link_id):
+        """trip_ids que percorrem a ligação"""
+        lo, hi = self.link_hop_start[link_id], self.link_hop_start[link_id + 1]
+        return self.trip_ids[self.hop_trip[lo:hi]].tolist()
+
+    def edge_dicts(self, mask=None):
+        """
+        Uma dict por ligação (selecionada pela máscara), no formato
+        usado pelo routing, pela mutação e pela avaliação de caminhos.
+        """
+        link_ids = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        node_ids = self.node_ids.tolist()
+        route_ids = self.route_ids.tolist()
+
+        edges = []
+        for k, f, t, r, op, dist, time_min, co2 in zip(link_ids.tolist(),
+                                                       self.link_from[link_ids].tolist(),
+                                                       self.link_to[link_ids].tolist(),
+                                                       self.link_route[link_ids].tolist(),
+                                                       self.link_operator[link_ids].tolist(),
+                                                       self.link_dist_km[link_ids].tolist(),
+                                                       self.link_travel_time[link_ids].tolist(),
+                                                       self.link_co2[link_ids].tolist()):
+            edges.append({
+                'link_id': k,
+                'from': node_ids[f],
+                'to': node_ids[t],
+                'operator': OPERATORS[op],
+                'route_id': route_ids[r] if r >= 0 else None,
+                'travel_time': None if time_min != time_min else time_min,  # NaN → operador desconhecido
+                'dist_km': dist,
+                'co2': co2,
+            })
+        return edges
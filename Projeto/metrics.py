@@ -0,0 +1,202 @@
+# metrics.py
+
+"""
+Instrumentação: temporizadores e contadores com nome.
+
+Desligada por omissão; liga-se com metrics.enable() ou com a variável de
+ambiente CIN_METRICS=1. Desligada, timer() devolve um contexto vazio
+partilhado e count() retorna logo, pelo que o custo é uma verificação
+de uma variável global.
+
+    with metrics.timer('dijkstra'):
+        ...
+    metrics.count('moead_evaluations', n)
+
+    with metrics.request('caso 1') as r:   # decomposição de um pedido
+        ...
+    r.to_dict()
+
+Os valores são acumulados no registo global e em todos os pedidos ativos
+(por thread). Exportação em JSON (to_json) ou no formato de texto do
+Prometheus (to_prometheus).
+"""
+
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+enabled = os.environ.get('CIN_METRICS', '') not in ('', '0')
+
+_NULL = contextlib.nullcontext()
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+# ---------------------------
+# Registo
+# ---------------------------
+class Registry:
+    def __init__(self, name=None):
+        self.name = name
+        self.counters = {}
+        self.timers = {}  # nome -> [chamadas, total_s, máximo_s]
+
+    def add_time(self, key, seconds):
+        t = self.timers.get(key)
+        if t is None:
+            self.timers[key] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+
+    def add_count(self, key, n):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def merge(self, data):
+        """Acrescenta um registo exportado com to_dict (ex.: vindo de outro processo)"""
+        for key, n in data.get('counters', {}).items():
+            self.add_count(key, n)
+        for key, t in data.get('timers', {}).items():
+            cur = self.timers.setdefault(key, [0, 0.0, 0.0])
+            cur[0] += t['count']
+            cur[1] += t['total_s']
+            cur[2] = max(cur[2], t['max_s'])
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def to_dict(self):
+        data = {
+            'counters': dict(self.counters),
+            'timers': {
+                key: {'count': c, 'total_s': total, 'mean_s': total / c, 'max_s': mx}
+                for key, (c, total, mx) in self.timers.items()
+            },
+        }
+        if self.name is not None:
+            data['name'] = self.name
+        return data
+
+
+registry = Registry()
+
+
+def _targets():
+    return [registry] + getattr(_local, 'requests', [])
+
+
+# ---------------------------
+# Temporizadores e contadores
+# ---------------------------
+class _Timer:
+    __slots__ = ('key', 't0')
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        with _lock:
+            for r in _targets():
+                r.add_time(self.key, elapsed)
+        return False
+
+
+def timer(key):
+    """Contexto que mede o tempo do bloco (vazio se a instrumentação estiver desligada)"""
+    if not enabled:
+        return _NULL
+    return _Timer(key)
+
+
+def timed(key=None):
+    """Decorador: mede cada chamada da função"""
+    def decorator(fn):
+        name = key or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(key, n=1):
+    if not enabled:
+        return
+    with _lock:
+        for r in _targets():
+            r.add_count(key, n)
+
+
+@contextlib.contextmanager
+def request(name):
+    """Regista à parte tudo o que for medido dentro do bloco (nesta thread)"""
+    r = Registry(name)
+    stack = getattr(_local, 'requests', None)
+    if stack is None:
+        stack = _local.requests = []
+    stack.append(r)
+    try:
+        yield r
+    finally:
+        stack.remove(r)
+
+
+def reset():
+    with _lock:
+        registry.reset()
+
+
+# ---------------------------
+# Exportação
+# ---------------------------
+def to_json(reg=None, **kwargs):
+    return json.dumps((reg or registry).to_dict(), **kwargs)
+
+
+def _metric_name(prefix, key):
+    return prefix + re.sub(r'[^a-zA-Z0-9_]', '_', key)
+
+
+def to_prometheus(reg=None, prefix='cin_'):
+    """Formato de exposição em texto do Prometheus"""
+    reg = reg or registry
+    lines = []
+    for key, n in sorted(reg.counters.items()):
+        name = _metric_name(prefix, key) + '_total'
+        lines += [f"# TYPE {name} counter", f"{name} {n}"]
+    for key, (c, total, mx) in sorted(reg.timers.items()):
+        name = _metric_name(prefix, key) + '_seconds'
+        lines += [
+            f"# TYPE {name} summary",
+            f"{name}_count {c}",
+            f"{name}_sum {total:.9f}",
+            f"# TYPE {name}_max gauge",
+            f"{name}_max {mx:.9f}",
+        ]
+    return "\n".join(lines) + "\n"
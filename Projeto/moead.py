@@ -1,85 +1,193 @@
 # moead.py
 
+import math
 import random
+import time
+from functools import partial
 import numpy as np
-from init_population import initialize_population
-from path_evaluation import path_objective
+import metrics
+from init_population import initialize_population, seed_paths
+from path_evaluation import evaluate_path, reevaluate_path, cached_evaluation, objective_cache
 from routing import dijkstra
+from progress import generation_stats, reference_point, print_sink
+from state_pool import StatePool
 
 # ----------------------------
 # Classe Individual
 # ----------------------------
 class Individual:
-    def __init__(self, path):
+    def __init__(self, path, evaluation=None):
         self.path = path
+        self.evaluation = evaluation  # PathEvaluation (contribuições por aresta)
         self.objectives = None  # [tempo, CO2]
 
 # ----------------------------
-# Mutação de caminho agressiva e segura
+# Mutação que preserva a conectividade
 # ----------------------------
-def mutate_path(path, edges, max_mutations=2, max_subpath_length=3):
+def _hops_to(graph, target, max_hops):
+    """Nº mínimo de arestas de cada nó até target, só até max_hops (pesquisa para trás)"""
+    hops = {target: 0}
+    frontier = [target]
+    for d in range(1, max_hops + 1):
+        nxt = []
+        for v in frontier:
+            for u in graph.predecessors(v):
+                if u not in hops:
+                    hops[u] = d
+                    nxt.append(u)
+        frontier = nxt
+    return hops
+
+def reroute_subpath(graph, source, target, max_hops, avoid=(), rng=random):
     """
-    Mutação diversificada e segura:
-    - Reconstrói múltiplos subtrechos curtos do caminho original.
-    - Garante caminhos válidos usando apenas nós/arestas ativos.
-    - Não altera caminhos curtos demais.
+    Desvio aleatório de source a target com no máximo max_hops arestas,
+    sem passar pelos nós de avoid. Em cada passo só se escolhem vizinhos que
+    ainda chegam a target no orçamento que resta (pesquisa para trás
+    limitada), pelo que o passeio nunca se afasta sem volta.
+    Devolve os nós depois de source até target (inclusive), ou None.
     """
-    if len(path) <= 3:
-        return path.copy()  # caminho muito curto, não muta
-    
-    # Criar mapa de adjacência do grafo ativo
-    adjacency = {}
-    for e in edges:
-        adjacency.setdefault(e['from'], []).append(e['to'])
+    hops = _hops_to(graph, target, max_hops)
+    if hops.get(source, max_hops + 1) > max_hops:
+        return None
+
+    used = set(avoid)
+    used.add(source)
+    segment = []
+    u, left = source, max_hops
+    while u != target:
+        options = [v for v in dict.fromkeys(graph.successors(u))
+                   if hops.get(v, left) < left and v not in used]
+        if not options:
+            return None  # bloqueado pelos nós a evitar
+        u = int(rng.choice(options))
+        used.add(u)
+        segment.append(u)
+        left -= 1
+    return segment
+
+def mutate_path(path, graph, max_mutations=2, max_subpath_length=3, rng=random, detour_budget=2):
+    """
+    Mutação que mantém o caminho ligado:
+    - Escolhe dois pontos de corte com até max_subpath_length nós entre eles
+      e troca o trecho por um desvio aleatório entre os mesmos dois nós
+      (reroute_subpath), com no máximo detour_budget arestas a mais.
+    - O desvio não repete nós do resto do caminho (sem ciclos).
+    - Faz até 2 * max_mutations tentativas; um trecho sem desvio (ou em que
+      o desvio repete o trecho) fica como estava, pelo que o filho de um
+      caminho válido é sempre válido, com a mesma origem e destino.
+    rng: gerador aleatório (por omissão, o módulo random)
+    """
+    if len(path) < 2:
+        return path.copy()
 
     new_path = path.copy()
-    for _ in range(max_mutations):
-        if len(new_path) <= 3:
-            break  # não há trecho suficiente para mutar
-        start_idx = random.randint(1, len(new_path)-3)
-        end_idx = min(start_idx + max_subpath_length, len(new_path)-2)
-
-        # Reconstruir subtrecho
-        sub_start = new_path[start_idx-1]
-        reconstructed = []
-        current = sub_start
-        for _ in range(end_idx-start_idx+1):
-            neighbors = adjacency.get(current, [])
-            if not neighbors:
-                break
-            current = random.choice(neighbors)
-            reconstructed.append(current)
-
-        new_path[start_idx:end_idx+1] = reconstructed
-
-    new_path[-1] = path[-1]  # garantir destino correto
+    changed = 0
+    for _ in range(2 * max_mutations):  # tentativas (um desvio pode repetir o trecho)
+        if changed == max_mutations:
+            break
+        i = rng.randrange(len(new_path) - 1)
+        j = min(i + max_subpath_length + 1, len(new_path) - 1)
+        avoid = set(new_path[:i]) | set(new_path[j + 1:])
+        segment = reroute_subpath(graph, new_path[i], new_path[j], j - i + detour_budget, avoid, rng)
+        if segment is None:
+            metrics.count('mutation_reroute_failed')
+        elif segment != new_path[i + 1:j + 1]:
+            new_path[i + 1:j + 1] = segment
+            changed += 1
     return new_path
 
+# ----------------------------
+# Cruzamento em nós comuns
+# ----------------------------
+def remove_loops(path):
+    """
+    Remove ciclos: quando um nó reaparece, corta tudo desde a primeira
+    passagem. Linear no comprimento do caminho; o resultado continua ligado.
+    """
+    out = []
+    pos = {}
+    for v in path:
+        k = pos.get(v)
+        if k is None:
+            pos[v] = len(out)
+            out.append(v)
+        else:
+            for u in out[k + 1:]:
+                del pos[u]
+            del out[k + 1:]
+    return out
+
+def crossover_paths(path, mate, rng=random):
+    """
+    Cruzamento de dois caminhos com a mesma origem e destino: escolhe ao
+    acaso um nó intermédio comum (paragem ou cluster multimodal M###) e junta
+    o início de path com o fim de mate a partir desse nó, sem ciclos.
+    O índice nó -> posição de mate torna a procura dos nós comuns linear.
+    Sem nós comuns, devolve uma cópia de path.
+    """
+    index = {}
+    for k, v in enumerate(mate):
+        index.setdefault(v, k)
+    common = [(i, index[v]) for i, v in enumerate(path[1:-1], 1) if v in index]
+    if not common:
+        return path.copy()
+    i, j = rng.choice(common)
+    return remove_loops(path[:i] + mate[j:])
+
+def make_offspring(path, mate, graph, crossover_rate=0.5, rng=random):
+    """
+    Filho: com probabilidade crossover_rate, cruzamento com mate; se não
+    houver cruzamento ou este não der um caminho novo, mutação de path.
+    (Mutar o resultado do cruzamento desfaz muitas vezes a junção.)
+    """
+    if mate is not None and rng.random() < crossover_rate:
+        with metrics.timer('crossover'):
+            child = crossover_paths(path, mate, rng)
+        if child != path and child != mate:
+            metrics.count('moead_crossovers')
+            return child
+    with metrics.timer('mutate_path'):
+        return mutate_path(path, graph, max_mutations=2, max_subpath_length=3, rng=rng)
+
 # ----------------------------
 # Funções MOEA/D
 # ----------------------------
-def tchebycheff(ind, weights, ideal_point):
-    return max([w * abs(f - z) for w, f, z in zip(weights, ind.objectives, ideal_point)])
+def tchebycheff(objectives, weights, ideal_point):
+    """
+    Tchebycheff vetorizado: objectives e weights (..., M) com broadcast,
+    ex.: (T, M) objetivos dos vizinhos com (T, M) pesos → (T,)
+    """
+    return np.max(weights * np.abs(np.asarray(objectives) - ideal_point), axis=-1)
 
 def generate_weight_vectors(num_objs, pop_size):
-    weights = []
-    for _ in range(pop_size):
-        w = np.random.dirichlet(np.ones(num_objs))
-        weights.append(w.tolist())
-    return weights
-
-def get_neighbors(weights, T=10):
-    neighbors = []
-    for i, w in enumerate(weights):
-        distances = [np.linalg.norm(np.array(w)-np.array(wj)) for wj in weights]
-        idx = np.argsort(distances)[:T]
-        neighbors.append(idx)
+    """Matriz (pop_size, num_objs) de pesos (Dirichlet)"""
+    return np.random.dirichlet(np.ones(num_objs), size=pop_size)
+
+def get_neighbors(weights, T=10, block_size=256):
+    """
+    Índices (N, T) dos T vetores de pesos mais próximos de cada um (incluindo
+    o próprio), por ordem de distância. A matriz de distâncias é calculada
+    por blocos de linhas para não ocupar N×N de memória de uma vez.
+    """
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    T = min(T, n)
+    neighbors = np.empty((n, T), dtype=np.int64)
+    for lo in range(0, n, block_size):
+        block = weights[lo:lo + block_size]
+        dist = np.sum((block[:, None, :] - weights[None, :, :]) ** 2, axis=-1)
+        if T < n:
+            idx = np.argpartition(dist, T - 1, axis=1)[:, :T]
+        else:
+            idx = np.broadcast_to(np.arange(n), dist.shape)
+        d = np.take_along_axis(dist, idx, axis=1)
+        order = np.lexsort((idx, d), axis=1)  # distância, depois índice
+        neighbors[lo:lo + block_size] = np.take_along_axis(idx, order, axis=1)
     return neighbors
 
-def get_ideal_point(population):
-    num_objs = len(population[0].objectives)
-    ideal = [min([ind.objectives[i] for ind in population]) for i in range(num_objs)]
-    return ideal
+def get_ideal_point(objectives):
+    """Ponto ideal: mínimo de cada objetivo na matriz (N, M)"""
+    return np.min(objectives, axis=0)
 
 # ----------------------------
 # Inicializar população
@@ -87,77 +195,219 @@ def get_ideal_point(population):
 def initialize_population_MOEAD(pop_size=10,
                                 max_mode_changes=None,
                                 max_line_changes=None,
-                                max_walking_time=None):
-    path_init, nodes, edges = initialize_population()
-    population = [Individual(path_init)]
-    
-    for _ in range(pop_size-1):
-        new_path = mutate_path(path_init, edges, max_mutations=2, max_subpath_length=3)
-        population.append(Individual(new_path))
+                                max_walking_time=None,
+                                start_coords=(41.1780, -8.5980),
+                                end_coords=(41.1612, -8.6306),
+                                date=None,
+                                weights=None):
+    """
+    População inicial: caminhos distintos do seed_paths (dijkstra com os
+    pesos tempo/CO2 dos subproblemas e penalização das arestas já usadas);
+    se não chegarem para pop_size, os restantes são mutações das sementes.
+    weights: vetores de pesos do MOEA/D (por omissão, gerados aqui).
+    """
+    path_init, graph = initialize_population(start_coords, end_coords, date=date)
+    if weights is None:
+        weights = generate_weight_vectors(2, pop_size)
+    seeds = seed_paths(graph, graph.start, graph.end, weights, k=pop_size, fastest=path_init) or [path_init]
+
+    population = []
+    for path in seeds:
+        population.append(Individual(path, evaluate_path(path, graph)))
+
+    while len(population) < pop_size:
+        parent = population[len(population) % len(seeds)]
+        new_path = mutate_path(parent.path, graph, max_mutations=2, max_subpath_length=3)
+        population.append(Individual(new_path, reevaluate_path(parent.evaluation, new_path, graph)))
     
+    metrics.count('moead_evaluations', len(population))
     for ind in population:
-        ind.objectives = path_objective(
-            ind.path, edges,
+        ind.objectives = ind.evaluation.objectives(
             max_mode_changes=max_mode_changes,
             max_line_changes=max_line_changes,
             max_walking_time=max_walking_time
         )
     
-    return population, nodes, edges
+    return population, graph
+
+def update_neighbors(population, F, weights, nb, ideal, child, verbose=False):
+    """
+    Atualiza o ponto ideal e substitui os vizinhos nb que o filho melhora
+    (uma comparação de Tchebycheff para toda a vizinhança).
+    Devolve o número de substituições.
+    """
+    f_child = np.asarray(child.objectives, dtype=float)
+    np.minimum(ideal, f_child, out=ideal)
+    better = tchebycheff(f_child, weights[nb], ideal) < tchebycheff(F[nb], weights[nb], ideal)
+    for j in nb[better].tolist():
+        population[j] = child
+        if verbose:
+            print(f"  -> Atualizado Ind {j} com novo caminho: {child.path}")
+    F[nb[better]] = f_child
+    return int(np.count_nonzero(better))
+
+# ----------------------------
+# Geração de filhos em paralelo
+# ----------------------------
+def _make_child(state, task):
+    """
+    Cruza, muta e avalia um filho; a semente é própria do filho (reprodutível).
+    state: (grafo, restrições, crossover_rate, cache) da execução do moead.
+    """
+    graph, constraints, crossover_rate, cache = state
+    parent_path, parent_eval, mate_path, seed = task
+    rng = random.Random(seed)
+    child_path = make_offspring(parent_path, mate_path, graph, crossover_rate, rng)
+    with metrics.timer('path_evaluation'):
+        evaluation, objectives = cached_evaluation(parent_eval, child_path, graph, constraints, cache)
+    return child_path, evaluation, objectives
+
+def _children_pool(workers, state):
+    """
+    Pool para gerar os filhos de uma geração (ver state_pool). workers=1
+    dispensa o pool.
+    """
+    if workers == 1:
+        return None
+    return StatePool(_make_child, state, workers)
+
+def generate_children(population, neighbors, state, pool=None, workers=1):
+    """
+    Um filho por subproblema, todos a partir da população no início da
+    geração. Pais e sementes são sorteados em série (random), pelo que os
+    filhos não dependem do número de workers nem da ordem de execução.
+    state: o mesmo passado a _children_pool (ver _make_child).
+    """
+    tasks = []
+    for i in range(len(population)):
+        parent = population[int(random.choice(neighbors[i]))]
+        mate = population[int(random.choice(neighbors[i]))]
+        tasks.append((parent.path, parent.evaluation, mate.path, random.getrandbits(64)))
+
+    if pool is None:
+        results = map(partial(_make_child, state), tasks)
+    else:
+        chunksize = max(1, math.ceil(len(tasks) / (4 * workers)))
+        results = pool.map(tasks, chunksize=chunksize)
+
+    children = []
+    for child_path, evaluation, objectives in results:
+        child = Individual(child_path, evaluation)
+        child.objectives = objectives
+        children.append(child)
+    return children
 
 # ----------------------------
 # Loop principal do MOEA/D
 # ----------------------------
 def moead(num_gens=10, pop_size=20, T=5,
-          max_mode_changes=None, max_line_changes=None, max_walking_time=None):
-    population, nodes, edges = initialize_population_MOEAD(
+          max_mode_changes=None, max_line_changes=None, max_walking_time=None,
+          start_coords=(41.1780, -8.5980), end_coords=(41.1612, -8.6306), date=None,
+          workers=None, callback=None, verbose=False, crossover_rate=0.5, cache=objective_cache):
+    """
+    workers=None: MOEA/D clássico (cada filho é gerado com a população já
+    atualizada pelos anteriores).
+    workers>=1: modo por geração; os filhos de uma geração são gerados e
+    avaliados em paralelo por `workers` processos e as vizinhanças são
+    atualizadas depois, pela ordem dos subproblemas. Para a mesma semente
+    o resultado é o mesmo com qualquer número de workers.
+    callback: função chamada no fim de cada geração com as métricas
+    (ver progress.py); verbose=True imprime cada indivíduo e substituição.
+    crossover_rate: probabilidade de tentar o cruzamento de dois vizinhos
+    (crossover_paths) em vez da mutação; 0 = só mutação.
+    cache: ObjectiveCache dos filhos já avaliados (por omissão a do processo,
+    partilhada entre gerações e casos do mesmo dia); None desativa. A cache
+    do processo guarda estado entre execuções sem relação entre si (e é
+    herdada pelos workers com fork): repetir os mesmos casos e sementes
+    reaproveita as avaliações anteriores, o que falseia medições de tempo
+    (usar cache=None ou objective_cache.clear()).
+    """
+    t0 = time.perf_counter()
+    weights = generate_weight_vectors(2, pop_size)
+    population, graph = initialize_population_MOEAD(
         pop_size=pop_size,
         max_mode_changes=max_mode_changes,
         max_line_changes=max_line_changes,
-        max_walking_time=max_walking_time
+        max_walking_time=max_walking_time,
+        start_coords=start_coords,
+        end_coords=end_coords,
+        date=date,
+        weights=weights
     )
     
-    weights = generate_weight_vectors(2, pop_size)
+    # Objetivos da população numa matriz (N, M), sincronizada com population
+    F = np.array([ind.objectives for ind in population], dtype=float)
     neighbors = get_neighbors(weights, T)
-    ideal = get_ideal_point(population)
+    ideal = get_ideal_point(F)
+    hv_ref = reference_point(F)
+    evaluations = len(population)
+
+    def report(gen, replacements):
+        if callback is not None:
+            callback(generation_stats(gen + 1, F, ideal, hv_ref, replacements,
+                                      evaluations, time.perf_counter() - t0))
     
+    constraints = (max_mode_changes, max_line_changes, max_walking_time)
+
+    if workers is not None:
+        state = (graph, constraints, crossover_rate, cache)
+        pool = _children_pool(workers, state)
+        try:
+            for gen in range(num_gens):
+                if verbose:
+                    print(f"\n=== Geração {gen+1} ===")
+                children = generate_children(population, neighbors, state, pool, workers)
+                evaluations += len(children)
+                metrics.count('moead_evaluations', len(children))
+                metrics.count('moead_generations')
+                replacements = 0
+                for i, child in enumerate(children):
+                    replacements += update_neighbors(population, F, weights, neighbors[i], ideal, child, verbose)
+                report(gen, replacements)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return population, graph, ideal.tolist()
+
     for gen in range(num_gens):
-        print(f"\n=== Geração {gen+1} ===")
+        if verbose:
+            print(f"\n=== Geração {gen+1} ===")
+        replacements = 0
         for i, ind in enumerate(population):
-            print(f"Ind {i}: Caminho atual: {ind.path}")
-
-            nb_idx = random.choice(neighbors[i])
-            child_path = mutate_path(population[nb_idx].path, edges, max_mutations=2, max_subpath_length=3)
-            child = Individual(child_path)
-            
-            # Avaliar objetivos do filho com restrições
-            child.objectives = path_objective(
-                child.path, edges,
-                max_mode_changes=max_mode_changes,
-                max_line_changes=max_line_changes,
-                max_walking_time=max_walking_time
-            )
-
-            ideal = [min(zi, fi) for zi, fi in zip(ideal, child.objectives)]
-
-            for j in neighbors[i]:
-                f_old = tchebycheff(population[j], weights[j], ideal)
-                f_new = tchebycheff(child, weights[j], ideal)
-                if f_new < f_old:
-                    population[j] = child
-                    print(f"  -> Atualizado Ind {j} com novo caminho: {child.path}")
+            if verbose:
+                print(f"Ind {i}: Caminho atual: {ind.path}")
+
+            parent = population[random.choice(neighbors[i])]
+            mate = population[random.choice(neighbors[i])]
+            child_path = make_offspring(parent.path, mate.path, graph, crossover_rate)
+            with metrics.timer('path_evaluation'):
+                # Da cache, ou reavaliando só o trecho alterado em relação ao pai
+                evaluation, objectives = cached_evaluation(parent.evaluation, child_path, graph, constraints, cache)
+                child = Individual(child_path, evaluation)
+                child.objectives = objectives
+
+            evaluations += 1
+            replacements += update_neighbors(population, F, weights, neighbors[i], ideal, child, verbose)
+        metrics.count('moead_evaluations', len(population))
+        metrics.count('moead_generations')
+        report(gen, replacements)
     
-    return population, nodes, edges, ideal
+    return population, graph, ideal.tolist()
 
 # ----------------------------
 # Teste rápido
 # ----------------------------
 if __name__ == "__main__":
-    pop, nodes, edges, ideal = moead(
+    pop, graph, ideal = moead(
         num_gens=5, pop_size=10, T=3,
-        max_mode_changes=3, max_line_changes=3, max_walking_time=5
+        max_mode_changes=3, max_line_changes=3, max_walking_time=5,
+        callback=print_sink
     )
     print("\nPopulação final:")
     for i, ind in enumerate(pop):
         print(f"Ind {i}: Tempo={ind.objectives[0]:.2f} min, CO2={ind.objectives[1]:.2f} g")
-        print(f"  Caminho final: {ind.path}")
+        print(f"  Caminho final: {graph.path_names(ind.path)}")
+
+    stats = objective_cache.stats()
+    print(f"\nCache de objetivos: {stats['hits']} acertos, {stats['misses']} falhas "
+          f"({stats['hit_rate']:.1%}), {stats['size']} entradas")
@@ -0,0 +1,215 @@
+# pareto_router.py
+
+"""
+Frente de Pareto exata tempo / CO2 (label-setting bi-objetivo, estilo Martins).
+
+Cada etiqueta (label) é um caminho parcial até um nó, com o tempo e o CO2
+acumulados segundo as regras da path_objective: penalização de mudança de
+modo e de linha (que dependem do operador e da linha da aresta anterior),
+CO2 por aresta e, quando há limites, os contadores de mudanças e o tempo a
+pé usados nas penalizações das restrições. As etiquetas são processadas por
+ordem lexicográfica (tempo, CO2) e descartam-se as dominadas:
+
+- no mesmo nó, por outra etiqueta que não é pior em nada; se as duas
+  chegaram por operador/linha diferentes, a dominante tem de ter uma
+  margem de uma mudança de modo + uma de linha (a diferença máxima que
+  a aresta seguinte pode causar);
+- pelas soluções já encontradas no destino, usando um limite inferior
+  do tempo que falta (distância em linha reta à velocidade máxima).
+
+Entre dois nós só se usam as arestas de menor travel_time (as candidatas
+da path_objective). As linhas paralelas empatadas (mesmo operador, tempo
+e CO2) não dão etiquetas diferentes: a etiqueta guarda o conjunto das
+linhas em que o caminho pode ir e só conta uma mudança de linha quando
+nenhuma delas continua, que é o menor número de mudanças possível, o
+mesmo que a path_objective conta para o caminho. Os objetivos de cada
+caminho devolvido são exatamente path_objective(caminho, ...).
+"""
+
+import heapq
+import metrics
+from Constants import MODE_CHANGE_PENALTY_MIN, LINE_CHANGE_PENALTY_MIN
+from path_evaluation import path_objective
+from routing import travel_time_bound
+
+# Folga contra arredondamentos na comparação das somas acumuladas
+_EPS = 1e-9
+
+
+def _fastest_arcs(graph, u, cache):
+    """
+    (destino, operador, tempo, CO2, linhas) das arestas de menor travel_time
+    de u para cada vizinho; as empatadas com o mesmo operador e CO2 ficam
+    juntas, com o conjunto das suas linhas.
+    """
+    arcs = cache.get(u)
+    if arcs is None:
+        best = {}
+        for k, v, w in graph.out_arcs(u):
+            cur = best.get(v)
+            if cur is None or w < cur[0]:
+                best[v] = (w, [k])
+            elif w == cur[0]:
+                cur[1].append(k)
+        operator, route, co2 = graph.edge_operator, graph.edge_route, graph.edge_co2
+        arcs = []
+        for v, (w, ks) in best.items():
+            groups = {}
+            for k in ks:
+                groups.setdefault((operator[k], co2[k]), set()).add(route[k])
+            arcs.extend((v, op, w, c, frozenset(routes)) for (op, c), routes in groups.items())
+        cache[u] = arcs
+    return arcs
+
+
+@metrics.timed('pareto_paths')
+def pareto_paths(graph, source, target,
+                 max_mode_changes=None, max_line_changes=None, max_walking_time=None,
+                 penalty_multiplier=100.0, heuristic=None, max_labels=None):
+    """
+    Frente de Pareto de (tempo, CO2) entre source e target.
+    Devolve [(objetivos, caminho)] ordenada por tempo, com objetivos iguais
+    aos da path_objective com as mesmas restrições.
+    heuristic: limite inferior do tempo até target (por omissão
+    routing.travel_time_bound); max_labels: limite opcional de etiquetas
+    processadas (a frente deixa de ser garantidamente exata).
+    """
+    if heuristic is None:
+        heuristic = travel_time_bound(graph, target)
+    use_modes = max_mode_changes is not None
+    use_lines = max_line_changes is not None
+    use_walk = max_walking_time is not None
+    switch_margin = MODE_CHANGE_PENALTY_MIN + LINE_CHANGE_PENALTY_MIN
+
+    def penalty(m, l, wk):
+        # Penalização das restrições (como na path_objective); só cresce ao longo do caminho
+        p = 0.0
+        if use_modes and m > max_mode_changes:
+            p += (m - max_mode_changes) * MODE_CHANGE_PENALTY_MIN * penalty_multiplier
+        if use_lines and l > max_line_changes:
+            p += (l - max_line_changes) * LINE_CHANGE_PENALTY_MIN * penalty_multiplier
+        if use_walk and wk > max_walking_time:
+            p += (wk - max_walking_time) * penalty_multiplier
+        return p
+
+    # Etiqueta: (tempo, co2, mudanças de modo, de linha, tempo a pé, operador,
+    #            linhas em que pode ir (frozenset), nó, pai, penalização)
+    labels = [(0.0, 0.0, 0, 0, 0.0, None, None, source, -1, 0.0)]
+    heap = [(0.0, 0.0, 0)]
+    settled = {}     # nó -> etiquetas permanentes
+    at_target = []   # (tempo, co2) com penalização das etiquetas no destino
+    arcs_cache = {}
+    processed = 0
+
+    def dominated(lab, others):
+        # Tempo e CO2 já com a penalização das restrições; um contador acima
+        # do limite paga o máximo por cada unidade a mais, pelo que deixa de
+        # ser preciso compará-lo (as mudanças só no mesmo operador/linha)
+        t, c, m, l, wk, op, rt, _, _, p = lab[:10]
+        for o in others:
+            ot, oc, om, ol, owk, oop, ort, _, _, op_pen = o[:10]
+            # Com o mesmo operador as mudanças de modo seguintes são as mesmas;
+            # mais linhas possíveis nunca obrigam a mais mudanças de linha
+            same_op = oop == op
+            same = same_op and (ort == rt or (ort is not None and rt is not None and ort >= rt))
+            margin_t = 0.0 if same else LINE_CHANGE_PENALTY_MIN if same_op else switch_margin
+            margin_m = 0 if same_op else 1
+            margin_l = 0 if same else 1
+            if (ot + op_pen + margin_t <= t + p + _EPS and oc + op_pen <= c + p + _EPS
+                    and (not use_modes or om + margin_m <= m or (same_op and m >= max_mode_changes))
+                    and (not use_lines or ol + margin_l <= l or (same and l >= max_line_changes))
+                    and (not use_walk or owk <= wk + _EPS or wk >= max_walking_time)):
+                return True
+        return False
+
+    def bounded_out(t, c, p, v):
+        # Nenhuma solução desta etiqueta bate as já encontradas no destino
+        lb_t = t + heuristic(v) + p
+        lb_c = c + p
+        for ft, fc in at_target:
+            if ft <= lb_t + _EPS and fc <= lb_c + _EPS:
+                return True
+        return False
+
+    while heap:
+        _, _, idx = heapq.heappop(heap)
+        lab = labels[idx]
+        t, c, m, l, wk, op, rt, u, _, p = lab
+
+        perm = settled.setdefault(u, [])
+        if dominated(lab, perm) or bounded_out(t, c, p, u):
+            continue
+        perm.append(lab + (idx,))
+        processed += 1
+        if max_labels is not None and processed > max_labels:
+            break
+
+        if u == target:
+            at_target.append((t + p, c + p))
+            continue
+
+        for v, e_op, e_t, e_co2, e_rts in _fastest_arcs(graph, u, arcs_cache):
+            nt, nm, nl, nrt = t + e_t, m, l, e_rts
+            if op is not None and e_op != op:
+                nm += 1
+                nt += MODE_CHANGE_PENALTY_MIN
+            if rt is not None:
+                shared = rt & e_rts
+                if shared:
+                    nrt = shared  # continua numa das linhas
+                elif None not in rt and None not in e_rts:
+                    nl += 1
+                    nt += LINE_CHANGE_PENALTY_MIN
+            nc = c + e_co2
+            nwk = wk + e_t if e_op == 'WALK' else wk
+
+            pen = penalty(nm, nl, nwk)
+            new = (nt, nc, nm, nl, nwk, e_op, nrt, v, idx, pen)
+            if dominated(new, settled.get(v, ())) or bounded_out(nt, nc, pen, v):
+                continue
+            labels.append(new)
+            heapq.heappush(heap, (nt + pen, nc + pen, len(labels) - 1))
+
+    # Caminhos das etiquetas do destino, avaliados pela path_objective
+    results = {}
+    for lab in settled.get(target, ()):
+        path = []
+        i = lab[-1]
+        while i >= 0:
+            path.append(labels[i][7])
+            i = labels[i][8]
+        path.reverse()
+        obj = path_objective(path, graph, max_mode_changes, max_line_changes, max_walking_time,
+                             penalty_multiplier)
+        results.setdefault(tuple(obj), path)
+
+    # Só as soluções não dominadas (a penalização das restrições pode dominar algumas)
+    front = sorted(results.items())
+    pareto = []
+    best_co2 = float('inf')
+    for obj, path in front:
+        if obj[1] < best_co2:
+            pareto.append((list(obj), path))
+            best_co2 = obj[1]
+
+    if metrics.enabled:
+        metrics.count('pareto_labels', len(labels))
+        metrics.count('pareto_labels_settled', processed)
+    return pareto
+
+
+def pareto_front(start_coords=(41.1780, -8.5980), end_coords=(41.1612, -8.6306), date=None, **kwargs):
+    """Frente de Pareto entre duas coordenadas (lat, lon) numa data; devolve (frente, grafo)"""
+    from datetime import datetime
+    from init_population import query_graph
+
+    if date is None:
+        date = datetime.today().date()
+    graph = query_graph(start_coords, end_coords, date)
+    return pareto_paths(graph, graph.start, graph.end, **kwargs), graph
+
+
+if __name__ == "__main__":
+    front, graph = pareto_front(max_mode_changes=3, max_line_changes=3, max_walking_time=5)
+    for (time_min, co2), path in front:
+        print(f"Tempo={time_min:.2f} min, CO2={co2:.2f} g: {' - '.join(graph.path_names(path))}")
@@ -1,32 +1,255 @@
 # path_objective.py
 
-import math
-from typing import List, Dict
+import threading
+from collections import OrderedDict
+from typing import List
+import metrics
 from Constants import (
-    WALK_SPEED_KMH,
-    BUS_SPEED_KMH,
-    METRO_SPEED_KMH,
     MODE_CHANGE_PENALTY_MIN,
     LINE_CHANGE_PENALTY_MIN,
-    BUS_EMISSION_GCO2_PER_KM,
-    METRO_EMISSION_GCO2_PER_KM,
-    WALK_EMISSION_GCO2_PER_KM,
 )
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Distância entre duas coordenadas GPS em km"""
-    R = 6371  # km
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
+# ---------------------------
+# Contribuições por aresta
+# ---------------------------
+class PathEvaluation:
+    """
+    Contribuições de cada aresta de um caminho (posição i = path[i] → path[i+1]):
+    arestas candidatas (as de menor travel_time entre os dois nós), aresta
+    usada, tempo, CO2, tempo a pé e se há mudança de modo/linha em relação
+    à aresta válida anterior. Os objetivos são somas destas listas, pelo que
+    um filho pode reaproveitar as contribuições do pai e recalcular só o
+    trecho alterado (reevaluate_path).
+    Não é alterada depois de criada (pode ser partilhada entre indivíduos).
+    """
+    __slots__ = ('path', 'ties', 'edges', 'time', 'co2', 'walk', 'mode', 'line')
+
+    def __init__(self, path, ties, edges, time, co2, walk, mode, line):
+        self.path = path
+        self.ties = ties
+        self.edges = edges
+        self.time = time
+        self.co2 = co2
+        self.walk = walk
+        self.mode = mode
+        self.line = line
+
+    def objectives(self, max_mode_changes=None, max_line_changes=None, max_walking_time=None,
+                   penalty_multiplier=100.0):
+        num_mode_changes = sum(self.mode)
+        num_line_changes = sum(self.line)
+        walking_time = sum(self.walk)
+        total_time = (
+            sum(self.time)
+            + num_mode_changes * MODE_CHANGE_PENALTY_MIN
+            + num_line_changes * LINE_CHANGE_PENALTY_MIN
+        )
+        total_co2 = sum(self.co2)
+
+        # Penalizações por restrições externas
+        penalty_time = 0.0
+        if max_mode_changes is not None and num_mode_changes > max_mode_changes:
+            penalty_time += (num_mode_changes - max_mode_changes) * MODE_CHANGE_PENALTY_MIN * penalty_multiplier
+        if max_line_changes is not None and num_line_changes > max_line_changes:
+            penalty_time += (num_line_changes - max_line_changes) * LINE_CHANGE_PENALTY_MIN * penalty_multiplier
+        if max_walking_time is not None and walking_time > max_walking_time:
+            penalty_time += (walking_time - max_walking_time) * penalty_multiplier
+
+        total_time_with_penalty = total_time + penalty_time
+        total_co2_with_penalty = total_co2 + penalty_time  # opcional: penalizar CO2 também
+
+        # Retornar objetivos para MOEA/D
+        return [total_time_with_penalty, total_co2_with_penalty]
+
+
+def _fastest_edges(graph, u, v):
+    """
+    Candidatas u → v: (aresta, operador, linha, tempo, CO2) das arestas de
+    menor travel_time, pela ordem do grafo (vazio se não houver aresta).
+    """
+    best, ties = None, ()
+    for k, t, w in graph.out_arcs(u):
+        if t == v:
+            if best is None or w < best:
+                best, ties = w, (k,)
+            elif w == best:
+                ties += (k,)
+    operator, route, co2 = graph.edge_operator, graph.edge_route, graph.edge_co2
+    return tuple([(k, operator[k], route[k], best, co2[k]) for k in ties])
+
+
+def _choose(ties, i, prev_key):
+    """
+    Candidata usada na posição i, dado o (operador, linha) da aresta válida
+    anterior. Entre candidatas empatadas (linhas paralelas com o mesmo tempo)
+    continua na linha anterior sempre que possível e, ao entrar numa linha,
+    escolhe a que segue o caminho durante mais posições. Assim o caminho tem
+    o menor número de mudanças de linha possível para os mesmos nós.
+    A procura à frente nunca passa da posição em que a linha escolhida
+    deixa de servir o caminho (onde há nova escolha).
+    """
+    cands = ties[i]
+    if len(cands) == 1:
+        return cands[0]
+    keys = [c[1:3] for c in cands]
+    if prev_key in keys:
+        return cands[keys.index(prev_key)]
+    # Candidatas que continuam nas posições seguintes, até restar uma
+    alive = list(range(len(cands)))
+    for j in range(i + 1, len(ties)):
+        later = ties[j]
+        if not later:
+            continue
+        later_keys = {c[1:3] for c in later}
+        still = [a for a in alive if keys[a] in later_keys]
+        if not still:
+            break
+        alive = still
+        if len(alive) == 1:
+            break
+    return cands[alive[0]]
+
+
+def _used_key(ev, i):
+    """(operador, linha) da aresta usada na posição i"""
+    e = ev.edges[i]
+    for c in ev.ties[i]:
+        if c[0] == e:
+            return c[1:3]
+
+
+def _key_before(ev, i):
+    """(operador, linha) da última aresta válida antes da posição i (None se não houver)"""
+    for k in range(i - 1, -1, -1):
+        if ev.edges[k] is not None:
+            return _used_key(ev, k)
+    return None
+
+
+def _fill(ev, lo, hi, parent=None, shift=0):
+    """
+    Escolhe as arestas e recalcula as contribuições a partir da posição lo.
+    Sem parent, até ao fim. Com parent (cujas contribuições já estão em ev
+    fora de [lo, hi), com as do sufixo deslocadas de shift), pára na
+    primeira posição >= hi em que a aresta válida anterior tem o mesmo
+    operador/linha que no pai: daí em diante as escolhas são as do pai.
+    """
+    ties, edges = ev.ties, ev.edges
+    prev_key = _key_before(ev, lo)
+    parent_key = _key_before(parent, hi + shift) if parent is not None else None
+    for i in range(lo, len(ties)):
+        if parent is not None and i >= hi:
+            if prev_key == parent_key:
+                return
+            if parent.edges[i + shift] is not None:
+                parent_key = _used_key(parent, i + shift)
+        if not ties[i]:  # ignorar arestas inexistentes
+            edges[i] = None
+            ev.time[i] = ev.co2[i] = ev.walk[i] = 0.0
+            ev.mode[i] = ev.line[i] = 0
+            continue
+        e, operator, route, time_min, co2 = _choose(ties, i, prev_key)
+        edges[i] = e
+        ev.time[i] = time_min
+        ev.co2[i] = co2  # CO2 pré-calculado por aresta
+        ev.walk[i] = time_min if operator == 'WALK' else 0.0
+        if prev_key is None:
+            ev.mode[i] = ev.line[i] = 0
+        else:
+            # Mudança de modo / de linha em relação à aresta válida anterior
+            ev.mode[i] = 1 if operator != prev_key[0] else 0
+            ev.line[i] = 1 if route is not None and prev_key[1] is not None and route != prev_key[1] else 0
+        prev_key = (operator, route)
 
-def path_objective(path: List[str], edges: List[Dict], 
+
+def _run_start(ev, lo):
+    """
+    Posição a partir da qual as escolhas podem depender das posições >= lo:
+    lo, se a escolha ao entrar na linha usada antes de lo já não olhava
+    para lá de lo-1 (só uma das candidatas seguia até lá); senão, a
+    posição em que se entrou nessa linha.
+    """
+    edges, ties = ev.edges, ev.ties
+    start, key, shared = lo, None, None
+    for k in range(lo - 1, -1, -1):
+        if edges[k] is None:
+            continue
+        k_key = _used_key(ev, k)
+        if key is not None and k_key != key:
+            break
+        # Linhas que servem todas as posições de k a lo-1
+        keys = {c[1:3] for c in ties[k]}
+        shared = keys if shared is None else shared & keys
+        if len(shared) == 1:
+            return lo
+        start, key = k, k_key
+    return start
+
+
+def evaluate_path(path: List[int], graph):
+    """Avaliação completa de um caminho (ids inteiros de nós do TransitGraph)"""
+    ties = [_fastest_edges(graph, u, v) for u, v in zip(path, path[1:])]
+    n = len(ties)
+    ev = PathEvaluation(path, ties, [None] * n, [0.0] * n, [0.0] * n, [0.0] * n, [0] * n, [0] * n)
+    _fill(ev, 0, n)
+    return ev
+
+
+def reevaluate_path(parent: PathEvaluation, path: List[int], graph):
+    """
+    Avaliação de um caminho obtido por alteração de parent.path (ex.: mutate_path).
+    Reaproveita as candidatas e as contribuições do prefixo e do sufixo comuns
+    e só consulta o grafo para o trecho alterado. As escolhas são refeitas a
+    partir do trecho (ou da entrada na linha que chega a ele, se essa escolha
+    olhava para o trecho) até a linha à saída dele coincidir com a do pai;
+    o resultado é idêntico ao de evaluate_path.
+    """
+    old = parent.path
+    if path == old:
+        return parent
+    n_old, n_new = len(old), len(path)
+    if n_new < 2 or n_old < 2:
+        return evaluate_path(path, graph)
+
+    # Prefixo e sufixo de nós comuns
+    limit = min(n_old, n_new)
+    p = 0
+    while p < limit and path[p] == old[p]:
+        p += 1
+    s = 0
+    while s < limit - p and path[n_new - 1 - s] == old[n_old - 1 - s]:
+        s += 1
+
+    # Arestas [lo, hi) do filho são novas; as do sufixo estão deslocadas de shift no pai
+    lo = max(p - 1, 0)
+    hi = n_new - s
+    shift = n_old - n_new
+    window = hi - lo
+
+    def splice(values, fill):
+        return values[:lo] + [fill] * window + values[hi + shift:]
+
+    ev = PathEvaluation(
+        path,
+        parent.ties[:lo] + [_fastest_edges(graph, path[i], path[i + 1]) for i in range(lo, hi)]
+        + parent.ties[hi + shift:],
+        splice(parent.edges, None),
+        splice(parent.time, 0.0),
+        splice(parent.co2, 0.0),
+        splice(parent.walk, 0.0),
+        splice(parent.mode, 0),
+        splice(parent.line, 0),
+    )
+    _fill(ev, _run_start(ev, lo), hi, parent, shift)
+    return ev
+
+
+@metrics.timed('path_objective')
+def path_objective(path: List[int], graph,
                    max_mode_changes=None, max_line_changes=None, max_walking_time=None,
                    penalty_multiplier=100.0):
     """
-    Função objetivo para MOEA/D:
+    Função objetivo para MOEA/D (path: ids inteiros de nós do TransitGraph):
     - Minimizar tempo total
     - Minimizar emissão CO2
     Penalizações aplicadas por restrições:
@@ -34,74 +257,87 @@ def path_objective(path: List[str], edges: List[Dict],
     2) Limite máximo de mudanças de linha
     3) Limite máximo de tempo a pé
     """
-    total_time = 0.0
-    walking_time = 0.0
-    num_mode_changes = 0
-    num_line_changes = 0
-    total_co2 = 0.0
+    return evaluate_path(path, graph).objectives(
+        max_mode_changes, max_line_changes, max_walking_time, penalty_multiplier
+    )
 
-    prev_operator = None
-    prev_route = None
 
-    # Mapa rápido de arestas
-    edge_map = {(e['from'], e['to']): e for e in edges}
+# ---------------------------
+# Cache de avaliações
+# ---------------------------
+class ObjectiveCache:
+    """
+    Cache LRU (grafo, caminho, restrições) -> (PathEvaluation, objetivos).
+    A chave do grafo (cache_key) identifica o grafo do dia e as arestas
+    próprias do pedido, pelo que a cache pode ser partilhada entre gerações
+    e entre casos no mesmo dia. maxsize limita o nº de entradas (memória).
+    Com processos (fork) cada processo usa e conta a sua cópia.
+    """
+    def __init__(self, maxsize=20000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    for i in range(len(path) - 1):
-        from_node = path[i]
-        to_node = path[i+1]
+    @staticmethod
+    def key(graph, path, constraints):
+        return graph.cache_key, tuple(path), constraints
 
-        if (from_node, to_node) not in edge_map:
-            continue  # ignorar arestas inexistentes
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        metrics.count('objective_cache_hits' if value is not None else 'objective_cache_misses')
+        return value
 
-        e = edge_map[(from_node, to_node)]
-        operator = e['operator']
-        route = e.get('route_id')
-        time_min = e.get('travel_time', 0.0)
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
 
-        total_time += time_min
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
 
-        # Tempo a pé
-        if operator == 'WALK':
-            walking_time += time_min
-            co2_per_km = WALK_EMISSION_GCO2_PER_KM
-        elif operator == 'STCP':
-            co2_per_km = BUS_EMISSION_GCO2_PER_KM
-        elif operator == 'METRO':
-            co2_per_km = METRO_EMISSION_GCO2_PER_KM
-        else:
-            co2_per_km = 0.0
-
-        # Distância aproximada para CO2
-        lat1, lon1 = e['from_pos'][1], e['from_pos'][0]
-        lat2, lon2 = e['to_pos'][1], e['to_pos'][0]
-        dist_km = haversine_distance(lat1, lon1, lat2, lon2)
-        total_co2 += dist_km * co2_per_km
-
-        # Mudanças de modo
-        if prev_operator is not None and operator != prev_operator:
-            num_mode_changes += 1
-            total_time += MODE_CHANGE_PENALTY_MIN
-
-        # Mudanças de linha
-        if prev_route is not None and route != prev_route:
-            if route is not None and prev_route is not None:
-                num_line_changes += 1
-                total_time += LINE_CHANGE_PENALTY_MIN
-
-        prev_operator = operator
-        prev_route = route
-
-    # Penalizações por restrições externas
-    penalty_time = 0.0
-    if max_mode_changes is not None and num_mode_changes > max_mode_changes:
-        penalty_time += (num_mode_changes - max_mode_changes) * MODE_CHANGE_PENALTY_MIN * penalty_multiplier
-    if max_line_changes is not None and num_line_changes > max_line_changes:
-        penalty_time += (num_line_changes - max_line_changes) * LINE_CHANGE_PENALTY_MIN * penalty_multiplier
-    if max_walking_time is not None and walking_time > max_walking_time:
-        penalty_time += (walking_time - max_walking_time) * penalty_multiplier
-
-    total_time_with_penalty = total_time + penalty_time
-    total_co2_with_penalty = total_co2 + penalty_time  # opcional: penalizar CO2 também
-
-    # Retornar objetivos para MOEA/D
-    return [total_time_with_penalty, total_co2_with_penalty]
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Cache por omissão do processo (partilhada por todos os MOEA/D do mesmo processo)
+objective_cache = ObjectiveCache()
+
+
+def cached_evaluation(parent: PathEvaluation, path: List[int], graph, constraints, cache=objective_cache):
+    """
+    (PathEvaluation, objetivos) de path com as restrições
+    (max_mode_changes, max_line_changes, max_walking_time): da cache, ou por
+    reevaluate_path a partir de parent. cache=None desativa a cache.
+    """
+    if cache is None:
+        evaluation = reevaluate_path(parent, path, graph)
+        return evaluation, evaluation.objectives(*constraints)
+    key = cache.key(graph, path, constraints)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit[0], list(hit[1])
+    evaluation = reevaluate_path(parent, path, graph)
+    objectives = evaluation.objectives(*constraints)
+    cache.put(key, (evaluation, list(objectives)))
+    return evaluation, objectives
@@ -0,0 +1,107 @@
+# progress.py
+
+"""
+Progresso do MOEA/D por geração.
+
+O moead chama callback(stats) no fim de cada geração, com um dict:
+    generation    número da geração (1, 2, ...)
+    best          melhor valor de cada objetivo na população [tempo, CO2]
+    ideal         ponto ideal (inclui filhos que não entraram na população)
+    hypervolume   hipervolume da população (2 objetivos, ponto de referência fixo)
+    replacements  substituições feitas nesta geração
+    evaluations   avaliações de caminhos feitas até aqui
+    elapsed       segundos desde o início do moead
+
+Qualquer função que receba o dict serve de destino; abaixo ficam os
+mais comuns (consola, logging, ficheiro JSON Lines, lista em memória).
+"""
+
+import json
+import logging
+import numpy as np
+
+
+# ---------------------------
+# Hipervolume (2 objetivos, minimização)
+# ---------------------------
+def hypervolume_2d(points, ref):
+    """Área dominada pelos pontos e limitada pelo ponto de referência ref"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    points = points[np.all(points < ref, axis=1)]
+    if len(points) == 0:
+        return 0.0
+    points = points[np.lexsort((points[:, 1], points[:, 0]))]
+
+    hv = 0.0
+    prev_f1 = ref[1]
+    for f0, f1 in points.tolist():
+        if f1 < prev_f1:  # ponto não dominado pelos anteriores
+            hv += (ref[0] - f0) * (prev_f1 - f1)
+            prev_f1 = f1
+    return float(hv)
+
+
+def reference_point(objectives, margin=0.1):
+    """Ponto de referência a partir da população inicial (nadir + margem)"""
+    nadir = np.max(objectives, axis=0)
+    return np.maximum(nadir * (1 + margin), nadir + 1.0)
+
+
+def generation_stats(generation, objectives, ideal, ref, replacements, evaluations, elapsed):
+    return {
+        'generation': generation,
+        'best': np.min(objectives, axis=0).tolist(),
+        'ideal': np.asarray(ideal, dtype=float).tolist(),
+        'hypervolume': hypervolume_2d(objectives, ref) if objectives.shape[1] == 2 else None,
+        'replacements': replacements,
+        'evaluations': evaluations,
+        'elapsed': elapsed,
+    }
+
+
+# ---------------------------
+# Destinos
+# ---------------------------
+def format_stats(stats):
+    best = ", ".join(f"{v:.2f}" for v in stats['best'])
+    hv = stats['hypervolume']
+    return (
+        f"Geração {stats['generation']}: melhor=[{best}] "
+        f"HV={'-' if hv is None else f'{hv:.2f}'} substituições={stats['replacements']} "
+        f"avaliações={stats['evaluations']} ({stats['elapsed']:.2f}s)"
+    )
+
+
+def print_sink(stats):
+    print(format_stats(stats))
+
+
+class LogSink:
+    """Envia cada geração para um logger (por omissão, o logger 'moead')"""
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('moead')
+        self.level = level
+
+    def __call__(self, stats):
+        self.logger.log(self.level, format_stats(stats))
+
+
+class JsonlSink:
+    """Escreve uma linha JSON por geração (ficheiro aberto pelo chamador ou caminho)"""
+    def __init__(self, file):
+        self._own = isinstance(file, str)
+        self.file = open(file, 'w') if self._own else file
+
+    def __call__(self, stats):
+        self.file.write(json.dumps(stats) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self._own:
+            self.file.close()
+
+
+class ListSink(list):
+    """Guarda as estatísticas em memória (ex.: para gráficos de convergência)"""
+    def __call__(self, stats):
+        self.append(stats)
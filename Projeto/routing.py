@@ -1,93 +1,58 @@
 # routing.py
 
 import heapq
-from typing import List, Dict, Tuple
-from Constants import (
-    WALK_SPEED_KMH,
-    BUS_SPEED_KMH,
-    METRO_SPEED_KMH
-)
-
-# ---------------------------
-# Distância Haversine
-# ---------------------------
-def haversine_distance(lat1, lon1, lat2, lon2):
-    import math
-    R = 6371  # km
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    )
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
+from typing import List, Dict, Tuple, Optional, Callable
+import numpy as np
+import metrics
+from geometry import haversine_km, travel_times, MAX_SPEED_KMH
 
 # ---------------------------
 # Cálculo de travel_time
 # ---------------------------
+@metrics.timed('compute_travel_time')
 def compute_travel_time(edges: List[Dict]):
     """
     Calcula o tempo de viagem (minutos) para cada aresta
-    com base na distância e no operador.
+    com base na distância e no operador (vetorizado).
+    from_pos / to_pos no formato de node_positions: (lon, lat).
     """
-    for e in edges:
-        lat1, lon1 = e['from_pos']
-        lat2, lon2 = e['to_pos']
-
-        distance_km = haversine_distance(lat1, lon1, lat2, lon2)
-
-        operator = e['operator'].upper()
-
-        if operator in ('WALK', 'LINK'):
-            speed = WALK_SPEED_KMH
-
-        elif operator == 'STCP':
-            speed = BUS_SPEED_KMH
-
-        elif operator == 'METRO':
-            speed = METRO_SPEED_KMH
-
-        else:
-            # operador desconhecido → ignorar aresta
-            e['travel_time'] = None
-            continue
+    if not edges:
+        return
+    from_pos = np.array([e['from_pos'] for e in edges], dtype=float)
+    to_pos = np.array([e['to_pos'] for e in edges], dtype=float)
+    distance_km = haversine_km(from_pos[:, 1], from_pos[:, 0], to_pos[:, 1], to_pos[:, 0])
+    times = travel_times(distance_km, [e['operator'] for e in edges])
 
-        e['travel_time'] = (distance_km / speed) * 60  # minutos
+    for e, t in zip(edges, times.tolist()):
+        # operador desconhecido → ignorar aresta
+        e['travel_time'] = None if t != t else t
 
 
 # ---------------------------
 # Dijkstra seguro
 # ---------------------------
+@metrics.timed('dijkstra')
 def dijkstra(
-    nodes: List[str],
-    edges: List[Dict],
-    source: str,
-    target: str,
-    weight_key: str = 'travel_time'
-) -> Tuple[float, List[str]]:
-
-    graph = {n: [] for n in nodes}
-
-    for e in edges:
-        cost = e.get(weight_key)
-        if cost is None:
-            continue
-        if e['from'] not in graph or e['to'] not in graph:
-            continue
-
-        graph[e['from']].append((e['to'], cost, e))
-
-    dist = {n: float('inf') for n in nodes}
-    prev = {n: None for n in nodes}
-    dist[source] = 0.0
+    graph,
+    source: int,
+    target: int,
+    weights: Optional[List[float]] = None
+) -> Tuple[float, List[int]]:
+    """
+    Caminho mínimo no TransitGraph / QueryGraph (ids inteiros, adjacência CSR).
+    weights: peso por id de aresta (por omissão graph.travel_time).
+    Só visita os nós alcançados, pelo que o custo não depende do tamanho do grafo.
+    """
+    dist = {source: 0.0}
+    prev = {}
 
-    counter = 0
+    counter = 0  # relaxações bem-sucedidas (= inserções no heap)
+    pops = 0
     heap = [(0.0, counter, source)]
 
     while heap:
         d, _, u = heapq.heappop(heap)
+        pops += 1
 
         if u == target:
             break
@@ -95,22 +60,243 @@ def dijkstra(
         if d > dist[u]:
             continue
 
-        for v, cost, edge_data in graph[u]:
-            alt = d + cost
-            if alt < dist[v]:
+        for _, v, w in graph.out_arcs(u, weights):
+            alt = d + w
+            if alt < dist.get(v, float('inf')):
                 dist[v] = alt
-                prev[v] = (u, edge_data)
+                prev[v] = u
                 counter += 1
                 heapq.heappush(heap, (alt, counter, v))
 
+    if metrics.enabled:
+        metrics.count('dijkstra_queries')
+        metrics.count('dijkstra_relaxations', counter)
+        metrics.count('dijkstra_heap_pushes', counter + 1)
+        metrics.count('dijkstra_heap_pops', pops)
+
     # Reconstrução do caminho
     path = []
     u = target
-    while prev[u] is not None:
+    while u in prev:
         path.insert(0, u)
-        u, _ = prev[u]
+        u = prev[u]
 
     if path:
         path.insert(0, source)
 
-    return dist[target], path
+    return dist.get(target, float('inf')), path
+
+
+# ---------------------------
+# A*
+# ---------------------------
+def travel_time_bound(graph, target: int) -> Callable[[int], float]:
+    """
+    Limite inferior (minutos) do tempo de u até target: distância em linha
+    reta à velocidade do modo mais rápido. Como o travel_time de cada aresta
+    é distância / velocidade do operador, o limite é admissível e consistente.
+    A folga relativa de 1e-9 cobre os arredondamentos do haversine.
+    """
+    lat, lon = graph.node_coords()
+    factor = 60.0 / MAX_SPEED_KMH * (1 - 1e-9)
+    # Calculado para todos os nós de uma vez (vetorizado)
+    bound = (haversine_km(lat, lon, lat[target], lon[target]) * factor).tolist()
+    return bound.__getitem__
+
+
+@metrics.timed('astar')
+def astar(
+    graph,
+    source: int,
+    target: int,
+    weights: Optional[List[float]] = None,
+    heuristic: Optional[Callable[[int], float]] = None
+) -> Tuple[float, List[int]]:
+    """
+    Como o dijkstra, mas orientado para o destino pela heurística
+    (por omissão travel_time_bound, válida para os pesos travel_time;
+    com outros pesos e sem heurística dada, equivale ao dijkstra).
+    Devolve o mesmo custo ótimo visitando menos nós.
+    """
+    if heuristic is None:
+        heuristic = travel_time_bound(graph, target) if weights is None else (lambda u: 0.0)
+
+    dist = {source: 0.0}
+    prev = {}
+    h = {source: heuristic(source)}
+
+    counter = 0
+    pops = 0
+    heap = [(h[source], counter, source)]
+    closed = set()
+
+    while heap:
+        _, _, u = heapq.heappop(heap)
+        pops += 1
+
+        if u == target:
+            break
+        if u in closed:
+            continue
+        closed.add(u)
+
+        d = dist[u]
+        for _, v, w in graph.out_arcs(u, weights):
+            alt = d + w
+            if alt < dist.get(v, float('inf')):
+                dist[v] = alt
+                prev[v] = u
+                hv = h.get(v)
+                if hv is None:
+                    hv = h[v] = heuristic(v)
+                counter += 1
+                heapq.heappush(heap, (alt + hv, counter, v))
+
+    if metrics.enabled:
+        metrics.count('astar_queries')
+        metrics.count('astar_relaxations', counter)
+        metrics.count('astar_heap_pops', pops)
+
+    return dist.get(target, float('inf')), _path_from_prev(prev, source, target)
+
+
+# ---------------------------
+# Dijkstra bidirecional
+# ---------------------------
+@metrics.timed('bidirectional_dijkstra')
+def bidirectional_dijkstra(
+    graph,
+    source: int,
+    target: int,
+    weights: Optional[List[float]] = None
+) -> Tuple[float, List[int]]:
+    """
+    Pesquisa a partir da origem (arestas de saída) e do destino (arestas de
+    entrada, graph.in_arcs) ao mesmo tempo, expandindo o lado com a menor
+    distância no topo. Pára quando a soma dos dois topos já não pode
+    melhorar o melhor ponto de encontro.
+    """
+    if source == target:
+        return 0.0, []
+
+    inf = float('inf')
+    dist = ({source: 0.0}, {target: 0.0})
+    link = ({}, {})  # prev (para a frente) e next (para trás)
+    heaps = ([(0.0, 0, source)], [(0.0, 0, target)])
+    settled = (set(), set())
+    arcs = (graph.out_arcs, graph.in_arcs)
+
+    best, meet = inf, None
+    counter = 0
+    pops = 0
+
+    while heaps[0] and heaps[1]:
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        d, _, u = heapq.heappop(heaps[side])
+        pops += 1
+        if u in settled[side]:
+            continue
+        settled[side].add(u)
+
+        here, there = dist[side], dist[1 - side]
+        for _, v, w in arcs[side](u, weights):
+            alt = d + w
+            if alt < here.get(v, inf):
+                here[v] = alt
+                link[side][v] = u
+                counter += 1
+                heapq.heappush(heaps[side], (alt, counter, v))
+            other = there.get(v)
+            if other is not None and here[v] + other < best:
+                best, meet = here[v] + other, v
+
+    if metrics.enabled:
+        metrics.count('bidirectional_queries')
+        metrics.count('bidirectional_relaxations', counter)
+        metrics.count('bidirectional_heap_pops', pops)
+
+    if meet is None:
+        return inf, []
+
+    # Origem → encontro pelos prev, encontro → destino pelos next
+    path = _path_from_prev(link[0], source, meet) or [source]
+    u = meet
+    while u != target:
+        u = link[1][u]
+        path.append(u)
+    return best, path
+
+
+def _path_from_prev(prev, source, target):
+    path = []
+    u = target
+    while u in prev:
+        path.append(u)
+        u = prev[u]
+    if path:
+        path.append(source)
+    path.reverse()
+    return path
+
+
+# ---------------------------
+# Dijkstra de um para todos
+# ---------------------------
+def dijkstra_all(graph, source: int, reverse: bool = False) -> np.ndarray:
+    """
+    Distâncias (travel_time) de source a todos os nós; com reverse=True,
+    de todos os nós até source (arestas de entrada). inf se inalcançável.
+    """
+    dist = np.full(graph.num_nodes, np.inf)
+    arcs = graph.in_arcs if reverse else graph.out_arcs
+    best = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > best[u]:
+            continue
+        dist[u] = d
+        for _, v, w in arcs(u):
+            alt = d + w
+            if alt < best.get(v, float('inf')):
+                best[v] = alt
+                heapq.heappush(heap, (alt, v))
+    return dist
+
+
+def one_to_all(graph, sources: Dict[int, Tuple[float, float]], attribute: Optional[List[float]] = None):
+    """
+    Dijkstra (travel_time) a partir de várias origens com custo inicial
+    (ex.: paragens a pé de um ponto). sources: {nó: (tempo, atributo)}.
+    Devolve (tempo, atributo) por nó em arrays: o atributo (ex.: edge_co2)
+    é acumulado ao longo do caminho mais rápido; inf / nan se inalcançável.
+    """
+    n = graph.num_nodes
+    dist = np.full(n, np.inf)
+    acc = np.full(n, np.nan)
+    best = {}
+    carried = {}
+    heap = []
+    for u, (t, a) in sources.items():
+        if t < best.get(u, float('inf')):
+            best[u] = t
+            carried[u] = a
+            heap.append((t, u))
+    heapq.heapify(heap)
+
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > best[u]:
+            continue
+        dist[u] = d
+        a = carried[u]
+        acc[u] = a
+        for k, v, w in graph.out_arcs(u):
+            alt = d + w
+            if alt < best.get(v, float('inf')):
+                best[v] = alt
+                carried[v] = a + attribute[k] if attribute is not None else a
+                heapq.heappush(heap, (alt, v))
+    return dist, acc
@@ -1,6 +1,17 @@
+import argparse
 import json
-from moead import moead, initialize_population_MOEAD
-from path_evaluation import path_objective
+import multiprocessing
+import os
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+import numpy as np
+import metrics
+from moead import moead
+from init_population import day_graph
+from path_evaluation import evaluate_path
 
 # Ler casos de teste
 def read_test_cases(filename):
@@ -22,93 +33,238 @@ def read_test_cases(filename):
             })
     return cases
 
+# Pernas de um caminho (pelas arestas usadas)
+def path_legs(path, graph, edges=None):
+    """
+    [(operador, linha, [paragens])] de um caminho, agrupando as arestas
+    seguidas com o mesmo operador/linha. edges: ids das arestas usadas
+    (PathEvaluation.edges); por omissão, as escolhidas por evaluate_path.
+    """
+    if edges is None:
+        edges = evaluate_path(path, graph).edges
+    legs = []
+    prev = None
+    for to_node, edge in zip(path[1:], edges):
+        if edge is None:
+            continue
+        key = (graph.edge_operator[edge] or "WALK", graph.edge_route[edge] or "WALK")
+        if key != prev:
+            legs.append((key[0], key[1], []))
+            prev = key
+        legs[-1][2].append(graph.node_ids[to_node])
+    return legs
+
 # Função para gerar relatório simplificado
-def format_path_report_simple(path, edges, objectives):
+@metrics.timed('report_format')
+def format_path_report_simple(path, graph, objectives, edges=None):
     """
     Gera um caminho simplificado:
     - Agrupa as paragens por operador/linha
     - Indica troca de transporte ou linha de forma concisa
     - Acrescenta tempo e CO2 no final
     """
-    report_lines = []
-    segment = []
-    prev_operator = None
-    prev_route = None
-
-    for i in range(len(path)-1):
-        from_node = path[i]
-        to_node = path[i+1]
-        edge = next((e for e in edges if e['from']==from_node and e['to']==to_node), None)
-        if edge is None:
-            continue
-        operator = edge.get('operator') or "WALK"
-        route = edge.get('route_id') or "WALK"
-
-        # Se mudar operador ou linha, finalizar segmento
-        if prev_operator and (operator != prev_operator or route != prev_route):
-            report_lines.append(f"{prev_operator}/{prev_route} " + " - ".join(map(str, segment)))
-            segment = []
-        segment.append(to_node)
-        prev_operator = operator
-        prev_route = route
-
-    # Adicionar último segmento
-    if segment:
-        report_lines.append(f"{prev_operator}/{prev_route} " + " - ".join(map(str, segment)))
-
-    # Acrescentar tempo e CO2
+    return format_solution(solution_record(path, graph, objectives, edges))
+
+def solution_record(path, graph, objectives, edges=None):
+    """
+    Solução em dicionário (serializável em JSON): objetivos, nós, arestas e
+    pernas. Cada aresta é identificada pela ligação (link_id do snapshot,
+    estável entre processos; None nas arestas a pé do pedido), com o
+    operador e a linha.
+    """
+    if edges is None:
+        edges = evaluate_path(path, graph).edges
     time, co2 = objectives
-    report_lines.append(f"[Tempo: {time:.2f} min, CO2: {co2:.2f} g]")
+    return {
+        'time': time,
+        'co2': co2,
+        'path': graph.path_names(path),
+        'edges': [{'link': graph.edge_link[e], 'operator': graph.edge_operator[e], 'route': graph.edge_route[e]}
+                  for e in edges if e is not None],
+        'legs': [{'operator': op, 'route': route, 'stops': stops}
+                 for op, route, stops in path_legs(path, graph, edges)],
+    }
+
+def format_solution(solution):
+    report_lines = [f"{leg['operator']}/{leg['route']} " + " - ".join(map(str, leg['stops']))
+                    for leg in solution['legs']]
+    report_lines.append(f"[Tempo: {solution['time']:.2f} min, CO2: {solution['co2']:.2f} g]")
     return "\n".join(report_lines)
 
+SOLUTION_TITLES = (
+    ('fastest', "Caminho mais rápido"),
+    ('cleanest', "Caminho com menos CO2"),
+    ('balanced', "Caminho equilibrado (tempo+CO2)"),
+)
+
+def format_case(record):
+    """Bloco de texto do relatório de um caso"""
+    out = [f"=== Caso {record['case']} ===\n"]
+    for key, title in SOLUTION_TITLES:
+        out.append(f">> {title}:\n")
+        out.append(format_solution(record['solutions'][key]) + "\n\n")
+    out.append("="*50 + "\n\n")
+    return "".join(out)
+
+# Executar um caso (também usado pelos processos do pool)
+def run_case(idx, case, seed, date=None):
+    """
+    Corre o MOEA/D para um caso e devolve o resultado num dicionário
+    (format_case dá o texto do relatório). A semente é fixada por caso,
+    pelo que o resultado não depende do processo nem da ordem em que os
+    casos são executados.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+    # Executar MOEA/D com a origem/destino e as restrições do caso
+    population, graph, ideal = moead(
+        num_gens=10, pop_size=10, T=3,
+        max_mode_changes=case['max_mode_changes'],
+        max_line_changes=case['max_line_changes'],
+        max_walking_time=case['max_walking_time'],
+        start_coords=case['start'],
+        end_coords=case['end'],
+        date=date
+    )
+
+    # Avaliar objetivos finais (garantia); a avaliação guarda as arestas usadas
+    for ind in population:
+        ind.evaluation = evaluate_path(ind.path, graph)
+        ind.objectives = ind.evaluation.objectives(
+            max_mode_changes=case['max_mode_changes'],
+            max_line_changes=case['max_line_changes'],
+            max_walking_time=case['max_walking_time']
+        )
+
+    # Selecionar soluções de interesse
+    chosen = {
+        'fastest': min(population, key=lambda x: x.objectives[0]),
+        'cleanest': min(population, key=lambda x: x.objectives[1]),
+        'balanced': min(population, key=lambda x: sum(x.objectives)),  # trade-off simples
+    }
+    with metrics.timer('report_format'):
+        solutions = {key: solution_record(ind.path, graph, ind.objectives, ind.evaluation.edges)
+                     for key, ind in chosen.items()}
+    return {'case': idx, **case, 'seed': seed, 'solutions': solutions}
+
+# Escrita dos resultados
+class ReportWriter:
+    """
+    Escreve cada caso assim que termina: o relatório em texto e,
+    opcionalmente, um JSONL (um objeto JSON por linha e por caso). Nada
+    fica em memória, pelo que lotes grandes usam memória constante.
+    """
+    def __init__(self, output_file, jsonl_file=None):
+        self.text = open(output_file, 'w')
+        self.jsonl = open(jsonl_file, 'w') if jsonl_file else None
+
+    def write(self, record):
+        self.text.write(format_case(record))
+        self.text.flush()
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.jsonl.flush()
+
+    def close(self):
+        self.text.close()
+        if self.jsonl is not None:
+            self.jsonl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _run_case_args(args):
+    """(resultado do caso, decomposição dos tempos do caso ou None)"""
+    if not metrics.enabled:
+        return run_case(*args), None
+    with metrics.request(f"caso {args[0]}") as r:
+        record = run_case(*args)
+    return record, r.to_dict()
+
+def write_metrics(metrics_file, breakdowns):
+    """Totais e decomposição por caso; formato Prometheus se o ficheiro acabar em .prom"""
+    with open(metrics_file, 'w') as f:
+        if metrics_file.endswith('.prom'):
+            f.write(metrics.to_prometheus())
+        else:
+            json.dump({'total': metrics.registry.to_dict(), 'cases': breakdowns}, f, indent=2)
+
 # Executar todos os testes
-def run_all_tests(test_file, output_file):
+def run_all_tests(test_file, output_file, workers=1, seed=0, date=None, metrics_file=None, jsonl_file=None):
+    """
+    workers=1 corre os casos em série; workers>1 (ou None = nº de CPUs)
+    distribui-os por um ProcessPoolExecutor. Os resultados são escritos
+    pela ordem dos casos, à medida que ficam prontos.
+    metrics_file: liga a instrumentação e grava os tempos/contadores no fim.
+    jsonl_file: grava também os resultados em JSONL (um caso por linha).
+    """
+    if metrics_file:
+        metrics.enable()
+    breakdowns = []
     test_cases = read_test_cases(test_file)
-    with open(output_file, 'w') as f_out:
-        for idx, case in enumerate(test_cases, 1):
-            f_out.write(f"=== Caso {idx} ===\n")
-            print(f"Executando caso {idx} ...")
-            
-            # Inicializar população e grafo com restrições do caso
-            population, nodes, edges = initialize_population_MOEAD(
-                pop_size=10,
-                max_mode_changes=case['max_mode_changes'],
-                max_line_changes=case['max_line_changes'],
-                max_walking_time=case['max_walking_time']
-            )
-            
-            # Executar MOEA/D com as restrições do caso
-            population, nodes, edges, ideal = moead(
-                num_gens=10, pop_size=10, T=3,
-                max_mode_changes=case['max_mode_changes'],
-                max_line_changes=case['max_line_changes'],
-                max_walking_time=case['max_walking_time']
-            )
-            
-            # Avaliar objetivos finais (garantia)
-            for ind in population:
-                ind.objectives = path_objective(
-                    ind.path, edges,
-                    max_mode_changes=case['max_mode_changes'],
-                    max_line_changes=case['max_line_changes'],
-                    max_walking_time=case['max_walking_time']
-                )
-            
-            # Selecionar soluções de interesse
-            fastest = min(population, key=lambda x: x.objectives[0])
-            cleanest = min(population, key=lambda x: x.objectives[1])
-            balanced = min(population, key=lambda x: sum(x.objectives))  # trade-off simples
-            
-            f_out.write(">> Caminho mais rápido:\n")
-            f_out.write(format_path_report_simple(fastest.path, edges, fastest.objectives) + "\n\n")
-            
-            f_out.write(">> Caminho com menos CO2:\n")
-            f_out.write(format_path_report_simple(cleanest.path, edges, cleanest.objectives) + "\n\n")
-            
-            f_out.write(">> Caminho equilibrado (tempo+CO2):\n")
-            f_out.write(format_path_report_simple(balanced.path, edges, balanced.objectives) + "\n\n")
-            f_out.write("="*50 + "\n\n")
+    if date is None:
+        date = datetime.today().date()
+    jobs = [(idx, case, seed + idx, date) for idx, case in enumerate(test_cases, 1)]
+
+    # Construir o grafo do dia antes de criar os processos: com fork os
+    # processos herdam-no (e os arrays do snapshot estão em memory-map)
+    day_graph(date)
+
+    with ReportWriter(output_file, jsonl_file) as writer:
+        if workers == 1:
+            for job in jobs:
+                print(f"Executando caso {job[0]} ...")
+                record, breakdown = _run_case_args(job)
+                writer.write(record)
+                if breakdown is not None:
+                    breakdowns.append(breakdown)
+        else:
+            _run_pool(jobs, workers, writer, breakdowns)
+
+    if metrics_file:
+        write_metrics(metrics_file, breakdowns)
+
+def _run_pool(jobs, workers, writer, breakdowns):
+    """
+    Casos distribuídos por um pool de processos (fork herda o grafo do dia).
+    Só há 2 casos por processo em curso de cada vez e cada resultado é
+    escrito (pela ordem dos casos) e largado assim que os anteriores estão
+    escritos, pelo que a memória depende do nº de processos e não do lote.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        running = deque(pool.submit(_run_case_args, job) for job in islice(pending, window))
+        idx = 0
+        while running:
+            record, breakdown = running.popleft().result()
+            for job in islice(pending, 1):
+                running.append(pool.submit(_run_case_args, job))
+            idx += 1
+            print(f"Caso {idx} concluído")
+            writer.write(record)
+            if breakdown is not None:
+                breakdowns.append(breakdown)
+                metrics.registry.merge(breakdown)  # medido noutro processo
 
 # Executar
 if __name__ == "__main__":
-    run_all_tests("tests/test_cases.txt", "tests/moead_results.txt")
+    parser = argparse.ArgumentParser(description="Corre os casos de teste do MOEA/D")
+    parser.add_argument("--tests", default="tests/test_cases.txt")
+    parser.add_argument("--output", default="tests/moead_results.txt")
+    parser.add_argument("--workers", type=int, default=1, help="processos (0 = nº de CPUs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--date", type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(), default=None,
+                        help="data de serviço (AAAA-MM-DD); por omissão, hoje")
+    parser.add_argument("--metrics", default=None,
+                        help="grava tempos e contadores (JSON, ou Prometheus se terminar em .prom)")
+    parser.add_argument("--jsonl", default=None, help="grava também os resultados em JSONL (um caso por linha)")
+    args = parser.parse_args()
+    run_all_tests(args.tests, args.output, workers=args.workers or None, seed=args.seed, date=args.date,
+                  metrics_file=args.metrics, jsonl_file=args.jsonl)
@@ -0,0 +1,82 @@
+# service_calendar.py
+
+"""
+Índice do calendário de serviços (calendar.txt + calendar_dates.txt).
+
+Pré-calcula, para todo o período de validade do feed, uma matriz booleana
+dia × service_id com os serviços ativos. Saber que serviços circulam numa
+data passa a ser uma indexação, em vez de percorrer o calendário.
+"""
+
+from datetime import datetime
+import numpy as np
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def _parse_date(yyyymmdd):
+    return datetime.strptime(str(yyyymmdd), "%Y%m%d").date()
+
+
+class ServiceCalendar:
+    def __init__(self, calendars, service_ids):
+        """
+        calendars: {operador: {'calendar': [...], 'calendar_dates': [...]}} (registos GTFS)
+        service_ids: ordem dos serviços nas máscaras (a do grafo compilado);
+                     serviços do calendário sem viagens no grafo são ignorados
+        """
+        self.service_ids = [str(s) for s in service_ids]
+        self.service_index = {s: i for i, s in enumerate(self.service_ids)}
+
+        records = [r for c in calendars.values() for r in c['calendar']]
+        exceptions = [r for c in calendars.values() for r in c['calendar_dates']]
+        dates = (
+            [r['start_date'] for r in records] + [r['end_date'] for r in records]
+            + [r['date'] for r in exceptions]
+        )
+
+        self._empty = np.zeros(len(self.service_ids), dtype=bool)
+        self._empty.flags.writeable = False
+        if not dates:
+            self.first_date = self.last_date = None
+            self.active = np.zeros((0, len(self.service_ids)), dtype=bool)
+            return
+
+        self.first_date = _parse_date(min(dates))
+        self.last_date = _parse_date(max(dates))
+        n_days = (self.last_date - self.first_date).days + 1
+        weekday = (np.arange(n_days) + self.first_date.weekday()) % 7
+
+        active = np.zeros((n_days, len(self.service_ids)), dtype=bool)
+        for r in records:
+            s = self.service_index.get(str(r['service_id']))
+            if s is None:
+                continue
+            lo = (_parse_date(r['start_date']) - self.first_date).days
+            hi = (_parse_date(r['end_date']) - self.first_date).days + 1
+            runs_on = np.array([r[d] == 1 for d in WEEKDAYS])
+            active[lo:hi, s] |= runs_on[weekday[lo:hi]]
+
+        # Exceções: 1 = serviço acrescentado, 2 = serviço removido
+        for r in exceptions:
+            s = self.service_index.get(str(r['service_id']))
+            if s is None:
+                continue
+            d = (_parse_date(r['date']) - self.first_date).days
+            if r['exception_type'] == 1:
+                active[d, s] = True
+            elif r['exception_type'] == 2:
+                active[d, s] = False
+
+        active.flags.writeable = False
+        self.active = active
+
+    def service_mask(self, date):
+        """Máscara (só de leitura) dos serviços ativos numa data (datetime.date)"""
+        if self.first_date is None or not (self.first_date <= date <= self.last_date):
+            return self._empty
+        return self.active[(date - self.first_date).days]
+
+    def active_services(self, date):
+        """Conjunto de service_id ativos numa data"""
+        return {self.service_ids[i] for i in np.flatnonzero(self.service_mask(date)).tolist()}
@@ -0,0 +1,126 @@
+# spatial_index.py
+
+"""
+Índice espacial em grelha para procura de paragens próximas.
+
+As coordenadas são projetadas (equiretangular, centrada no feed) para km
+e agrupadas em células quadradas. Uma consulta só calcula distâncias
+Haversine para os pontos das células vizinhas, em vez de percorrer
+todas as paragens.
+"""
+
+import math
+import numpy as np
+from geometry import EARTH_RADIUS_KM, haversine_km
+
+class SpatialIndex:
+    def __init__(self, lats, lons, ids=None, cell_km=0.5):
+        """
+        lats, lons: coordenadas dos pontos (graus)
+        ids: identificador devolvido para cada ponto (por omissão, a posição)
+        cell_km: lado das células da grelha
+        """
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.ids = list(range(len(self.lats))) if ids is None else list(ids)
+        self.cell_km = cell_km
+
+        self._lat0 = float(self.lats.mean()) if len(self.lats) else 0.0
+        self._cos0 = math.cos(math.radians(self._lat0))
+
+        cx, cy = self._cell(self.lats, self.lons)
+        self.cells = {}
+        for i, key in enumerate(zip(cx.tolist(), cy.tolist())):
+            self.cells.setdefault(key, []).append(i)
+        self.cells = {k: np.array(v, dtype=np.int64) for k, v in self.cells.items()}
+        self._bounds = (
+            (int(cx.min()), int(cx.max()), int(cy.min()), int(cy.max())) if len(cx) else (0, 0, 0, 0)
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, lat, lon):
+        x = np.radians(lon) * EARTH_RADIUS_KM * self._cos0
+        y = np.radians(lat) * EARTH_RADIUS_KM
+        return np.floor(x / self.cell_km).astype(np.int64), np.floor(y / self.cell_km).astype(np.int64)
+
+    def _ring(self, cx, cy, r):
+        """Índices dos pontos nas células à distância (Chebyshev) exatamente r"""
+        found = []
+        for dx in range(-r, r + 1):
+            for dy in range(-r, r + 1):
+                if max(abs(dx), abs(dy)) != r:
+                    continue
+                idx = self.cells.get((cx + dx, cy + dy))
+                if idx is not None:
+                    found.append(idx)
+        return found
+
+    # ---------------------------
+    # Consultas
+    # ---------------------------
+    def radius(self, lat, lon, radius_km):
+        """
+        Posições e distâncias (km) dos pontos a <= radius_km, por ordem de posição.
+        """
+        cx, cy = (int(c) for c in self._cell(lat, lon))
+        # +1 célula de margem para a distorção da projeção
+        reach = int(math.ceil(radius_km / self.cell_km)) + 1
+        cells = self.cells
+        chunks = [
+            cells[key]
+            for key in ((cx + dx, cy + dy) for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1))
+            if key in cells
+        ]
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        idx = np.sort(np.concatenate(chunks))
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        keep = dist <= radius_km
+        return idx[keep], dist[keep]
+
+    def nearest(self, lat, lon, k, max_distance_km=None):
+        """
+        Posições e distâncias (km) dos k pontos mais próximos, por ordem de distância.
+        """
+        if len(self) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        cx, cy = (int(c) for c in self._cell(lat, lon))
+        # Nenhuma célula fica a mais do que este número de anéis
+        x0, x1, y0, y1 = self._bounds
+        max_ring = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+        chunks = []
+        r = 0
+        while r <= max_ring:
+            chunks.extend(self._ring(cx, cy, r))
+            if chunks:
+                idx = np.concatenate(chunks)
+                dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+                # Pontos fora dos anéis já vistos estão a pelo menos (r - 1) células
+                bound = max(r - 1, 0) * self.cell_km
+                if len(idx) >= k and np.partition(dist, k - 1)[k - 1] <= bound:
+                    break
+                if max_distance_km is not None and bound > max_distance_km:
+                    break
+            r += 1
+
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        order = np.argsort(dist, kind='stable')
+        if max_distance_km is not None:
+            order = order[dist[order] <= max_distance_km]
+        order = order[:k]
+        return idx[order], dist[order]
+
+    def query_radius(self, lat, lon, radius_km):
+        """[(id, distância_km)] dos pontos a <= radius_km"""
+        idx, dist = self.radius(lat, lon, radius_km)
+        return [(self.ids[i], d) for i, d in zip(idx.tolist(), dist.tolist())]
+
+    def query_knn(self, lat, lon, k, max_distance_km=None):
+        """[(id, distância_km)] dos k pontos mais próximos"""
+        idx, dist = self.nearest(lat, lon, k, max_distance_km)
+        return [(self.ids[i], d) for i, d in zip(idx.tolist(), dist.tolist())]
@@ -0,0 +1,55 @@
+# state_pool.py
+
+"""
+Pool de workers que corre fn(state, tarefa) para cada tarefa, com um
+state grande (ex.: o grafo do dia) comum a todas as tarefas.
+
+Com fork usa processos, e cada processo recebe o state uma única vez, no
+arranque (initializer): é herdado pelo fork em vez de ser serializado em
+cada tarefa. Como cada pool tem os seus processos, basta um state global
+por processo. Sem fork usa threads, que partilham o state diretamente.
+
+    with StatePool(fn, state, workers) as pool:
+        results = pool.map(tasks, chunksize=4)
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+# State do processo (definido por _init_process no arranque de cada processo do pool)
+_process_state = None
+
+
+def _init_process(state):
+    global _process_state
+    _process_state = state
+
+
+def _run_in_process(fn, task):
+    return fn(_process_state, task)
+
+
+class StatePool:
+    """fn tem de ser uma função de módulo (é enviada aos processos pelo nome)"""
+    def __init__(self, fn, state, workers):
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                                initializer=_init_process, initargs=(state,))
+            self._run = partial(_run_in_process, fn)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            self._run = partial(fn, state)
+
+    def map(self, tasks, chunksize=1):
+        """Resultados pela ordem das tarefas"""
+        return self.executor.map(self._run, tasks, chunksize=chunksize)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,250 @@
+# timetable_router.py
+
+"""
+Routing por horário: "partir às T, chegar o mais cedo possível".
+
+Usa o Connection Scan Algorithm (CSA) sobre as conexões reais do
+stop_times.txt (uma por troço de viagem, com hora de partida e chegada),
+filtradas pelo calendário do dia e ordenadas por hora de partida.
+Ao contrário do dijkstra, o resultado inclui os tempos de espera e a
+frequência real de cada linha.
+
+Limitações: as horas são relativas ao dia de serviço pedido, pelo que as
+viagens do dia anterior que passam da meia-noite não são consideradas.
+"""
+
+import bisect
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+from geometry import haversine_distance
+from link_table import OPERATORS, OP_LINK
+from transit_graph import START_ID, END_ID
+from graph_builder import all_nodes, links, service_calendar
+from init_population import find_nearby_stops
+
+INF = float('inf')
+
+node_index = {n: i for i, n in enumerate(all_nodes)}
+START = len(all_nodes)      # mesmos índices que no TransitGraph
+END = len(all_nodes) + 1
+
+
+def seconds_to_hhmmss(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+# ============================================================
+# Conexões de um dia de serviço
+# ============================================================
+
+class Timetable:
+    def __init__(self, links, service_mask):
+        """
+        Conexões das viagens ativas, ordenadas por (partida, chegada, viagem,
+        posição na viagem): troços com a mesma hora (ex.: horários
+        arredondados ao minuto) ficam pela ordem da viagem, como o CSA exige.
+        service_mask: máscara por service_id (ServiceCalendar.service_mask)
+        """
+        hop_link = links.hop_links()
+        active = (
+            service_mask[links.trip_service[links.hop_trip]]
+            & (links.hop_dep >= 0) & (links.hop_arr >= links.hop_dep)
+        )
+        idx = np.flatnonzero(active)
+        idx = idx[np.lexsort((links.hop_seq[idx], links.hop_trip[idx], links.hop_arr[idx], links.hop_dep[idx]))]
+
+        dep = links.hop_dep[idx]
+        trip = links.hop_trip[idx]
+        seq = links.hop_seq[idx]
+        conn_link = hop_link[idx]
+
+        # Listas Python para o ciclo principal
+        self.dep = dep.tolist()
+        self.arr = links.hop_arr[idx].tolist()
+        self.frm = links.link_from[conn_link].tolist()
+        self.to = links.link_to[conn_link].tolist()
+        self.trip = trip.tolist()
+        self.link = conn_link.tolist()
+
+        # Conexões de cada viagem por ordem (reconstrução dos percursos)
+        self._trip_order = np.lexsort((seq, trip))
+        self._trip_sorted = trip[self._trip_order]
+
+        # Ligações a pé paragem ↔ cluster multimodal (segundos)
+        self.footpaths = {}
+        walk = np.flatnonzero(links.link_operator == OP_LINK)
+        for f, t, minutes in zip(links.link_from[walk].tolist(), links.link_to[walk].tolist(),
+                                 links.link_travel_time[walk].tolist()):
+            self.footpaths.setdefault(f, []).append((t, minutes * 60))
+
+        self.links = links
+
+    def __len__(self):
+        return len(self.dep)
+
+    def trip_connections(self, trip, first, last):
+        """Conexões da viagem entre as conexões first e last (inclusive)"""
+        lo = np.searchsorted(self._trip_sorted, trip, side='left')
+        hi = np.searchsorted(self._trip_sorted, trip, side='right')
+        conns = self._trip_order[lo:hi].tolist()
+        return conns[conns.index(first):conns.index(last) + 1]
+
+
+@lru_cache(maxsize=8)
+def timetable_for_date(date):
+    """Timetable de uma data (construída uma vez e reutilizada)"""
+    return Timetable(links, service_calendar.service_mask(date))
+
+
+# ============================================================
+# Connection Scan (earliest arrival)
+# ============================================================
+
+def earliest_arrival(timetable, origin_walks, target_walks, depart_at, direct_walk=None):
+    """
+    origin_walks: {nó: segundos a pé desde a origem}
+    target_walks: {nó: segundos a pé até ao destino}
+    depart_at: hora de partida (segundos desde o início do dia de serviço)
+    direct_walk: segundos a pé diretamente da origem ao destino (opcional)
+    Devolve a viagem (dict) ou None se o destino não for alcançável.
+    """
+    dep, arr, frm, to, trips = timetable.dep, timetable.arr, timetable.frm, timetable.to, timetable.trip
+    footpaths = timetable.footpaths
+
+    earliest = {}
+    arrived_by = {}
+    trip_enter = {}
+    best = [INF, None]  # [chegada ao destino, último nó antes do destino]
+    if direct_walk is not None:
+        best[0] = depart_at + direct_walk
+
+    def reach(node, t, how):
+        stack = [(node, t, how)]
+        while stack:
+            node, t, how = stack.pop()
+            if t >= earliest.get(node, INF):
+                continue
+            earliest[node] = t
+            arrived_by[node] = how
+            w = target_walks.get(node)
+            if w is not None and t + w < best[0]:
+                best[0], best[1] = t + w, node
+            for v, secs in footpaths.get(node, ()):
+                stack.append((v, t + secs, ('walk', node)))
+
+    for node, secs in origin_walks.items():
+        reach(node, depart_at + secs, ('origin',))
+
+    for c in range(bisect.bisect_left(dep, depart_at), len(dep)):
+        if dep[c] >= best[0]:
+            break  # nenhuma conexão posterior melhora a chegada
+        trip = trips[c]
+        if trip in trip_enter or earliest.get(frm[c], INF) <= dep[c]:
+            trip_enter.setdefault(trip, c)
+            if arr[c] < earliest.get(to[c], INF):
+                reach(to[c], arr[c], ('ride', trip, trip_enter[trip], c))
+
+    if best[0] == INF:
+        return None
+    return _journey(timetable, arrived_by, earliest, origin_walks, target_walks, depart_at, best)
+
+
+def _journey(timetable, arrived_by, earliest, origin_walks, target_walks, depart_at, best):
+    """Reconstrói as pernas da viagem a partir dos apontadores do CSA"""
+    tt = timetable
+    names = all_nodes
+    arrival, node = best
+
+    if node is None:
+        legs = [_walk_leg(START_ID, END_ID, depart_at, arrival)]
+        return _result(depart_at, arrival, legs, [START, END])
+
+    legs = [_walk_leg(names[node], END_ID, earliest[node], arrival)]
+    path = [node, END]
+    while True:
+        how = arrived_by[node]
+        if how[0] == 'origin':
+            legs.insert(0, _walk_leg(START_ID, names[node], depart_at, earliest[node]))
+            path.insert(0, START)
+            break
+        if how[0] == 'walk':
+            prev = how[1]
+            legs.insert(0, _walk_leg(names[prev], names[node], earliest[prev], earliest[node], mode='LINK'))
+            path.insert(0, prev)
+            node = prev
+            continue
+
+        _, trip, enter, exit_ = how
+        conns = tt.trip_connections(trip, enter, exit_)
+        link = tt.link[enter]
+        route = tt.links.link_route[link]
+        legs.insert(0, {
+            'mode': OPERATORS[tt.links.link_operator[link]],
+            'route_id': str(tt.links.route_ids[route]) if route >= 0 else None,
+            'trip_id': str(tt.links.trip_ids[trip]),
+            'from': names[tt.frm[enter]],
+            'to': names[tt.to[exit_]],
+            'departure': tt.dep[enter],
+            'arrival': tt.arr[exit_],
+            'stops': [names[tt.frm[enter]]] + [names[tt.to[c]] for c in conns],
+        })
+        path[0:0] = [tt.frm[c] for c in conns]
+        node = tt.frm[enter]
+
+    return _result(depart_at, arrival, legs, path)
+
+
+def _walk_leg(frm, to, departure, arrival, mode='WALK'):
+    return {'mode': mode, 'route_id': None, 'trip_id': None, 'from': frm, 'to': to,
+            'departure': departure, 'arrival': arrival, 'stops': [frm, to]}
+
+
+def _result(depart_at, arrival, legs, path):
+    return {
+        'departure': depart_at,
+        'arrival': arrival,
+        'duration_min': (arrival - depart_at) / 60,
+        'legs': legs,
+        'path': path,  # ids inteiros, compatíveis com o TransitGraph / path_objective
+    }
+
+
+# ============================================================
+# Consulta a partir de coordenadas
+# ============================================================
+
+def plan_journey(start_coords=(41.1780, -8.5980), end_coords=(41.1612, -8.6306),
+                 depart_at=None, walk_speed_kmh=5.0, max_walk_km=0.8):
+    """
+    Viagem mais cedo possível entre duas coordenadas (lat, lon),
+    partindo em depart_at (datetime; por omissão, agora).
+    """
+    if depart_at is None:
+        depart_at = datetime.now()
+    timetable = timetable_for_date(depart_at.date())
+    t0 = depart_at.hour * 3600 + depart_at.minute * 60 + depart_at.second
+
+    start_lat, start_lon = start_coords
+    end_lat, end_lon = end_coords
+    to_secs = 3600 / walk_speed_kmh
+
+    origin_walks = {node_index[s]: d * to_secs for s, d in find_nearby_stops(start_lat, start_lon, max_walk_km)}
+    target_walks = {node_index[s]: d * to_secs for s, d in find_nearby_stops(end_lat, end_lon, max_walk_km)}
+
+    direct_km = haversine_distance(start_lat, start_lon, end_lat, end_lon)
+    direct_walk = direct_km * to_secs if direct_km <= max_walk_km else None
+
+    return earliest_arrival(timetable, origin_walks, target_walks, t0, direct_walk)
+
+
+if __name__ == "__main__":
+    journey = plan_journey(depart_at=datetime.now())
+    if journey is None:
+        print("Sem ligação para o horário pedido.")
+    else:
+        for leg in journey['legs']:
+            print(f"{seconds_to_hhmmss(leg['departure'])} → {seconds_to_hhmmss(leg['arrival'])}  "
+                  f"{leg['mode']}/{leg['route_id'] or leg['mode']}  " + " - ".join(leg['stops']))
+        print(f"[Duração: {journey['duration_min']:.1f} min]")
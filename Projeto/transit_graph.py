@@ -0,0 +1,288 @@
+# transit_graph.py
+
+"""
+Grafo de um dia de serviço com índices inteiros e adjacência CSR.
+
+É construído uma vez por dia de serviço e partilhado pelo routing
+(dijkstra), pela mutação (mutate_path) e pela avaliação de caminhos
+(path_objective), para que o custo de cada chamada seja proporcional
+ao trabalho feito e não ao tamanho do grafo.
+
+As arestas de um nó u são os ids range(offsets[u], offsets[u+1]);
+os atributos de cada aresta estão em listas indexadas pelo id.
+
+O TransitGraph não é alterado depois de construído. O que é próprio de
+cada pedido (posições e arestas WALK de __START__/__END__) fica num
+QueryGraph, que se sobrepõe ao grafo do dia sem o copiar.
+"""
+
+from itertools import chain, count
+import numpy as np
+
+START_ID = "__START__"
+END_ID = "__END__"
+
+# Identificador de cada grafo construído (chave das caches de avaliação)
+_graph_ids = count()
+
+
+class TransitGraph:
+    def __init__(self, node_ids, node_positions, edges):
+        """
+        node_ids: ids dos nós do grafo base
+        node_positions: id -> (lon, lat)
+        edges: dicts com 'from', 'to', 'operator', 'route_id', 'travel_time',
+               'dist_km', 'co2' (e opcionalmente 'link_id');
+               arestas sem travel_time são ignoradas
+        """
+        self.node_ids = list(node_ids) + [START_ID, END_ID]
+        self.node_index = {n: i for i, n in enumerate(self.node_ids)}
+        self.start = self.node_index[START_ID]
+        self.end = self.node_index[END_ID]
+
+        positions = [node_positions.get(n, (0.0, 0.0)) for n in self.node_ids]
+        self.node_lon = [p[0] for p in positions]
+        self.node_lat = [p[1] for p in positions]
+
+        edges = [e for e in edges if e.get('travel_time') is not None]
+        src = np.array([self.node_index[e['from']] for e in edges], dtype=np.int64)
+        order = np.argsort(src, kind='stable').tolist()
+        edges = [edges[k] for k in order]
+
+        # CSR: offsets + targets + pesos
+        counts = np.bincount(src, minlength=len(self.node_ids))
+        self.offsets = [0] + np.cumsum(counts).tolist()
+        self.targets = [self.node_index[e['to']] for e in edges]
+        self.travel_time = [e['travel_time'] for e in edges]
+
+        # Atributos por aresta
+        self.edge_from = src[order].tolist()
+        self.edge_operator = [e['operator'] for e in edges]
+        self.edge_route = [e.get('route_id') for e in edges]
+        self.edge_link = [e.get('link_id') for e in edges]
+        self.edge_dist_km = [e['dist_km'] for e in edges]
+        self.edge_co2 = [e['co2'] for e in edges]
+
+        # Adjacência inversa (pesquisa bidirecional) e coordenadas em arrays
+        # (heurísticas vetorizadas), construídas no primeiro uso
+        self._reverse = None
+        self._coords = None
+
+        # Identifica o grafo do dia nas caches (ex.: path_evaluation.ObjectiveCache)
+        self.cache_key = (next(_graph_ids),)
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    # ---------------------------
+    # Consultas
+    # ---------------------------
+    def out_edges(self, u):
+        """Ids das arestas que saem de u"""
+        return range(self.offsets[u], self.offsets[u + 1])
+
+    def out_arcs(self, u, weights=None):
+        """(id, destino, peso) das arestas que saem de u (peso por omissão: travel_time)"""
+        if weights is None:
+            weights = self.travel_time
+        a, b = self.offsets[u], self.offsets[u + 1]
+        return zip(range(a, b), self.targets[a:b], weights[a:b])
+
+    def successors(self, u):
+        """Nós vizinhos de u (com repetição quando há arestas paralelas)"""
+        return self.targets[self.offsets[u]:self.offsets[u + 1]]
+
+    def node_coords(self):
+        """(lat, lon) de todos os nós em arrays NumPy (só de leitura)"""
+        if self._coords is None:
+            lat, lon = np.array(self.node_lat), np.array(self.node_lon)
+            lat.flags.writeable = lon.flags.writeable = False
+            self._coords = (lat, lon)
+        return self._coords
+
+    def _reverse_csr(self):
+        if self._reverse is None:
+            targets = np.array(self.targets, dtype=np.int64)
+            order = np.argsort(targets, kind='stable')
+            counts = np.bincount(targets, minlength=self.num_nodes)
+            ids = order.tolist()
+            self._reverse = (
+                [0] + np.cumsum(counts).tolist(),
+                ids,
+                [self.edge_from[k] for k in ids],
+                [self.travel_time[k] for k in ids],
+            )
+        return self._reverse
+
+    def in_arcs(self, v, weights=None):
+        """(id, origem, peso) das arestas que chegam a v"""
+        offsets, ids, sources, times = self._reverse_csr()
+        a, b = offsets[v], offsets[v + 1]
+        if weights is None or weights is self.travel_time:
+            return zip(ids[a:b], sources[a:b], times[a:b])
+        return ((k, s, weights[k]) for k, s in zip(ids[a:b], sources[a:b]))
+
+    def predecessors(self, v):
+        """Nós com aresta para v (com repetição quando há arestas paralelas)"""
+        offsets, _, sources, _ = self._reverse_csr()
+        return sources[offsets[v]:offsets[v + 1]]
+
+    def edge_between(self, u, v):
+        """Aresta u → v de menor travel_time (None se não existir)"""
+        best = None
+        for k, t, w in self.out_arcs(u):
+            if t == v and (best is None or w < self.travel_time[best]):
+                best = k
+        return best
+
+    def path_names(self, path):
+        return [self.node_ids[u] for u in path]
+
+
+# ---------------------------
+# Vista de um pedido
+# ---------------------------
+class _Overlay:
+    """
+    Lista só de leitura: base partilhada + valores do pedido (sem copiar a base).
+    overrides substitui posições da base; extra acrescenta posições no fim.
+    """
+    __slots__ = ('base', 'n', 'extra', 'overrides')
+
+    def __init__(self, base, extra=(), overrides=None):
+        self.base = base
+        self.n = len(base)
+        self.extra = list(extra)
+        self.overrides = overrides or {}
+
+    def __len__(self):
+        return self.n + len(self.extra)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(len(self))
+            if stop <= self.n and step == 1 and not any(start <= i < stop for i in self.overrides):
+                return self.base[start:stop]
+            return [self[i] for i in range(start, stop, step)]
+        if k < 0:
+            k += len(self)
+        if k < self.n:
+            if k in self.overrides:
+                return self.overrides[k]
+            return self.base[k]
+        return self.extra[k - self.n]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class QueryGraph:
+    """
+    Grafo de um pedido: o TransitGraph do dia (imutável e partilhado) mais
+    as posições de __START__/__END__ e as arestas WALK de/para esses nós.
+    Nada é escrito no grafo base, pelo que vários pedidos podem correr em
+    simultâneo (threads) sobre o mesmo TransitGraph.
+    """
+    def __init__(self, base, start_pos, end_pos, edges):
+        """
+        start_pos, end_pos: (lon, lat) da origem e do destino
+        edges: dicts das arestas do pedido (mesmo formato do TransitGraph)
+        """
+        self.base = base
+        self.node_ids = base.node_ids
+        self.node_index = base.node_index
+        self.start = base.start
+        self.end = base.end
+
+        self.node_lon = _Overlay(base.node_lon, overrides={base.start: start_pos[0], base.end: end_pos[0]})
+        self.node_lat = _Overlay(base.node_lat, overrides={base.start: start_pos[1], base.end: end_pos[1]})
+
+        edges = [e for e in edges if e.get('travel_time') is not None]
+        n = base.num_edges
+        self.extra_out = {}
+        self.extra_in = {}
+        for i, e in enumerate(edges):
+            self.extra_out.setdefault(base.node_index[e['from']], []).append(n + i)
+            self.extra_in.setdefault(base.node_index[e['to']], []).append(n + i)
+
+        self.targets = _Overlay(base.targets, [base.node_index[e['to']] for e in edges])
+        self.travel_time = _Overlay(base.travel_time, [e['travel_time'] for e in edges])
+        self.edge_from = _Overlay(base.edge_from, [base.node_index[e['from']] for e in edges])
+        self.edge_operator = _Overlay(base.edge_operator, [e['operator'] for e in edges])
+        self.edge_route = _Overlay(base.edge_route, [e.get('route_id') for e in edges])
+        self.edge_link = _Overlay(base.edge_link, [e.get('link_id') for e in edges])
+        self.edge_dist_km = _Overlay(base.edge_dist_km, [e['dist_km'] for e in edges])
+        self.edge_co2 = _Overlay(base.edge_co2, [e['co2'] for e in edges])
+
+        # Dois pedidos com as mesmas arestas próprias avaliam os caminhos da mesma
+        # forma; o hash é calculado uma vez para a chave ficar pequena
+        signature = tuple(
+            (e['from'], e['to'], e['operator'], e.get('route_id'), e['travel_time'], e['co2']) for e in edges
+        )
+        self.cache_key = base.cache_key + (hash(signature), len(signature))
+
+    @property
+    def num_nodes(self):
+        return self.base.num_nodes
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def out_edges(self, u):
+        extra = self.extra_out.get(u)
+        base = self.base.out_edges(u)
+        return chain(base, extra) if extra else base
+
+    def out_arcs(self, u, weights=None):
+        if weights is None:
+            weights = self.travel_time
+        base_weights = weights.base if isinstance(weights, _Overlay) else weights
+        arcs = self.base.out_arcs(u, base_weights)
+        extra = self.extra_out.get(u)
+        if not extra:
+            return arcs
+        targets = self.targets
+        return chain(arcs, ((k, targets[k], weights[k]) for k in extra))
+
+    def node_coords(self):
+        lat, lon = (a.copy() for a in self.base.node_coords())
+        for u in (self.start, self.end):
+            lat[u], lon[u] = self.node_lat[u], self.node_lon[u]
+        return lat, lon
+
+    def in_arcs(self, v, weights=None):
+        if weights is None:
+            weights = self.travel_time
+        base_weights = weights.base if isinstance(weights, _Overlay) else weights
+        arcs = self.base.in_arcs(v, base_weights)
+        extra = self.extra_in.get(v)
+        if not extra:
+            return arcs
+        sources = self.edge_from
+        return chain(arcs, ((k, sources[k], weights[k]) for k in extra))
+
+    def successors(self, u):
+        extra = self.extra_out.get(u)
+        base = self.base.successors(u)
+        return base + [self.targets[k] for k in extra] if extra else base
+
+    def predecessors(self, v):
+        extra = self.extra_in.get(v)
+        base = self.base.predecessors(v)
+        return base + [self.edge_from[k] for k in extra] if extra else base
+
+    def edge_between(self, u, v):
+        best = None
+        for k, t, w in self.out_arcs(u):
+            if t == v and (best is None or w < self.travel_time[best]):
+                best = k
+        return best
+
+    def path_names(self, path):
+        return self.base.path_names(path)
@@ -0,0 +1,137 @@
+# travel_matrix.py
+
+"""
+Matrizes origem-destino de tempo de viagem e CO2.
+
+Uma única pesquisa (routing.one_to_all) por origem, no grafo do dia,
+em vez de um initialize_population por par. Os centróides das zonas são
+ligados às paragens a pé pela mesma regra do initialize_population
+(paragens a <= 0.8 km, arestas WALK à velocidade de marcha); se a
+origem e o destino estiverem a <= 0.8 km também se pode ir a pé
+diretamente. As origens podem ser distribuídas por vários processos.
+
+    times, co2 = travel_matrix(origins, destinations, date)
+
+times[i, j] em minutos (travel_time, sem penalizações de transbordo) e
+co2[i, j] em gramas, do caminho mais rápido; inf / nan se não houver ligação.
+"""
+
+import math
+import multiprocessing
+from datetime import datetime
+import numpy as np
+import metrics
+import routing
+from Constants import WALK_EMISSION_GCO2_PER_KM
+from geometry import haversine_km
+from init_population import day_graph, find_nearby_stops
+from state_pool import StatePool
+
+MAX_WALK_KM = 0.8
+
+
+# -----------------------------
+# --- Ligação dos centróides ao grafo
+# -----------------------------
+def snap_points(graph, points, max_walk_km=MAX_WALK_KM, walk_speed_kmh=5.0):
+    """
+    Para cada ponto (lat, lon): (nós, minutos a pé, g CO2 a pé) das paragens
+    a <= max_walk_km, em arrays.
+    """
+    snapped = []
+    for lat, lon in points:
+        near = find_nearby_stops(lat, lon, max_walk_km)
+        nodes = np.array([graph.node_index[s] for s, _ in near], dtype=np.int64)
+        dist_km = np.array([d for _, d in near], dtype=float)
+        snapped.append((nodes, dist_km / walk_speed_kmh * 60, dist_km * WALK_EMISSION_GCO2_PER_KM))
+    return snapped
+
+
+# -----------------------------
+# --- Uma origem
+# -----------------------------
+def _origin_row(state, i):
+    """
+    Linha i das matrizes: uma pesquisa a partir da origem i.
+    state: (grafo, pontos das origens, pontos dos destinos) de snap_points.
+    """
+    graph, origins, destinations = state
+    nodes, walk_min, walk_co2 = origins[i]
+    sources = {}
+    for u, t, c in zip(nodes.tolist(), walk_min.tolist(), walk_co2.tolist()):
+        if t < sources.get(u, (math.inf, 0.0))[0]:
+            sources[u] = (t, c)
+    with metrics.timer('matrix_origin_search'):
+        dist, co2 = routing.one_to_all(graph, sources, graph.edge_co2)
+
+    n = len(destinations)
+    times_row = np.full(n, np.inf)
+    co2_row = np.full(n, np.nan)
+    for j, (d_nodes, d_min, d_co2) in enumerate(destinations):
+        if len(d_nodes) == 0:
+            continue
+        total = dist[d_nodes] + d_min
+        k = int(np.argmin(total))
+        if np.isfinite(total[k]):
+            times_row[j] = total[k]
+            co2_row[j] = co2[d_nodes[k]] + d_co2[k]
+    return times_row, co2_row
+
+
+def _chunk_rows(state, rows):
+    return [_origin_row(state, i) for i in rows]
+
+
+# -----------------------------
+# --- Matrizes
+# -----------------------------
+@metrics.timed('travel_matrix')
+def travel_matrix(origins, destinations=None, date=None, workers=1,
+                  max_walk_km=MAX_WALK_KM, walk_speed_kmh=5.0):
+    """
+    origins, destinations: listas de (lat, lon) (destinations=None → as origens).
+    workers: processos (fork herda o grafo do dia); 1 corre em série.
+    Devolve (tempos em minutos, CO2 em gramas), arrays (n_origens, n_destinos).
+    """
+    if date is None:
+        date = datetime.today().date()
+    if destinations is None:
+        destinations = origins
+    graph = day_graph(date)
+
+    state = (
+        graph,
+        snap_points(graph, origins, max_walk_km, walk_speed_kmh),
+        snap_points(graph, destinations, max_walk_km, walk_speed_kmh),
+    )
+    rows = list(range(len(origins)))
+    if workers == 1 or len(rows) <= 1:
+        results = _chunk_rows(state, rows)
+    else:
+        n_chunks = 4 * (workers or multiprocessing.cpu_count())
+        chunks = [rows[k::n_chunks] for k in range(n_chunks) if rows[k::n_chunks]]
+        results = [None] * len(rows)
+        with StatePool(_chunk_rows, state, workers) as pool:
+            for chunk, chunk_rows in zip(chunks, pool.map(chunks)):
+                for i, row in zip(chunk, chunk_rows):
+                    results[i] = row
+
+    times = np.vstack([r[0] for r in results]) if results else np.empty((0, len(destinations)))
+    co2 = np.vstack([r[1] for r in results]) if results else np.empty((0, len(destinations)))
+
+    # Ir a pé diretamente quando origem e destino estão próximos
+    o = np.asarray(origins, dtype=float).reshape(-1, 2)
+    d = np.asarray(destinations, dtype=float).reshape(-1, 2)
+    direct_km = haversine_km(o[:, None, 0], o[:, None, 1], d[None, :, 0], d[None, :, 1])
+    direct_min = np.where(direct_km <= max_walk_km, direct_km / walk_speed_kmh * 60, np.inf)
+    walk_better = direct_min < times
+    times[walk_better] = direct_min[walk_better]
+    co2[walk_better] = direct_km[walk_better] * WALK_EMISSION_GCO2_PER_KM
+
+    return times, co2
+
+
+def one_to_many(origin, destinations, date=None, **kwargs):
+    """Tempos e CO2 (vetores) de uma origem para vários destinos"""
+    times, co2 = travel_matrix([origin], destinations, date, workers=1, **kwargs)
+    return times[0], co2[0]